@@ -13,6 +13,7 @@ class CPU:
         self.pc = 0  # program counter
         self.reg[7] = 0xF4  # SP (Stack Pointer)
         self.FL = [0] * 8  # The register is made up of 8 bits.
+        self.running = False
 
         # Instruction definition
         # LDI - This instruction sets a specified register to a specified value
@@ -29,6 +30,66 @@ class CPU:
         self.CMP = 0b10100111  # Compare the values in two registers
         self.JEQ = 0b01010101  # If `equal` flag is set (true), jump to the address stored in the given register.
         self.JNE = 0b01010110  # If `E` flag is clear (false, 0), jump to the address stored in the given register.
+        # the rest of the opcodes from asm/asm.py
+        self.AND = 0b10101000
+        self.DEC = 0b01100110
+        self.DIV = 0b10100011
+        self.INC = 0b01100101
+        self.INT = 0b01010010
+        self.IRET = 0b00010011
+        self.JGE = 0b01011010
+        self.JGT = 0b01010111
+        self.JLE = 0b01011001
+        self.JLT = 0b01011000
+        self.LD = 0b10000011
+        self.MOD = 0b10100100
+        self.NOP = 0b00000000
+        self.NOT = 0b01101001
+        self.OR = 0b10101010
+        self.PRA = 0b01001000
+        self.SHL = 0b10101100
+        self.SHR = 0b10101101
+        self.ST = 0b10000100
+        self.SUB = 0b10100001
+        self.XOR = 0b10101011
+
+        # Branch table: one handler per possible opcode byte, so `run()`
+        # decodes with a single list index instead of an if/elif chain.
+        self.branchtable = [self.handle_unknown] * 256
+        self.branchtable[self.SAVE] = self.handle_ldi
+        self.branchtable[self.PRINT_REG] = self.handle_prn
+        self.branchtable[self.HALT] = self.handle_hlt
+        self.branchtable[self.MULT] = self.handle_mul
+        self.branchtable[self.POP] = self.handle_pop
+        self.branchtable[self.PUSH] = self.handle_push
+        self.branchtable[self.ADD] = self.handle_add
+        self.branchtable[self.CALL] = self.handle_call
+        self.branchtable[self.JUMP] = self.handle_jmp
+        self.branchtable[self.RET] = self.handle_ret
+        self.branchtable[self.CMP] = self.handle_cmp
+        self.branchtable[self.JEQ] = self.handle_jeq
+        self.branchtable[self.JNE] = self.handle_jne
+        self.branchtable[self.AND] = self.handle_and
+        self.branchtable[self.DEC] = self.handle_dec
+        self.branchtable[self.DIV] = self.handle_div
+        self.branchtable[self.INC] = self.handle_inc
+        self.branchtable[self.INT] = self.handle_int
+        self.branchtable[self.IRET] = self.handle_iret
+        self.branchtable[self.JGE] = self.handle_jge
+        self.branchtable[self.JGT] = self.handle_jgt
+        self.branchtable[self.JLE] = self.handle_jle
+        self.branchtable[self.JLT] = self.handle_jlt
+        self.branchtable[self.LD] = self.handle_ld
+        self.branchtable[self.MOD] = self.handle_mod
+        self.branchtable[self.NOP] = self.handle_nop
+        self.branchtable[self.NOT] = self.handle_not
+        self.branchtable[self.OR] = self.handle_or
+        self.branchtable[self.PRA] = self.handle_pra
+        self.branchtable[self.SHL] = self.handle_shl
+        self.branchtable[self.SHR] = self.handle_shr
+        self.branchtable[self.ST] = self.handle_st
+        self.branchtable[self.SUB] = self.handle_sub
+        self.branchtable[self.XOR] = self.handle_xor
 
     def ram_read(self, address):
         '''
@@ -148,135 +209,176 @@ class CPU:
 
         print()
 
-    def run(self):
-        """Run the CPU."""
+    # Instruction handlers
+    #
+    # Every handler takes the two bytes following the opcode, already fetched
+    # by `run()`. Handlers that don't need them just ignore them.
 
-        running = True
-        # self.pc = 0
+    def handle_unknown(self, operand_a, operand_b):
+        print('command is not recognized')
+        sys.exit(1)
 
-        while running:
-            command = self.ram[self.pc]
+    def handle_nop(self, operand_a, operand_b):
+        pass
 
-            # SAVE
-            if command == self.SAVE:
-                num_to_save = self.ram[self.pc + 1]
-                register_address = self.ram[self.pc + 2]
-                self.reg[num_to_save] = register_address
-                # self.pc += 2  # (command >> 6)
+    def handle_hlt(self, operand_a, operand_b):
+        self.running = False
 
-            # PRINT_REG
-            elif command == self.PRINT_REG:
-                reg_address = self.ram[self.pc + 1]
-                print(self.reg[reg_address])
-                # same
-                # print(self.reg[self.ram_read(self.pc + 1)])
-                # self.pc += (command >> 6)
+    def handle_ldi(self, operand_a, operand_b):
+        self.reg[operand_a] = operand_b
 
-            elif command == self.ADD:
-                reg1_address = self.ram[self.pc + 1]
-                reg2_address = self.ram[self.pc + 2]
+    def handle_ld(self, operand_a, operand_b):
+        self.reg[operand_a] = self.ram_read(self.reg[operand_b])
 
-                # self.alu('ADD', reg1_address, reg2_address)
-                self.reg[reg1_address] += self.reg[reg2_address]
+    def handle_st(self, operand_a, operand_b):
+        self.ram_write(self.reg[operand_b], self.reg[operand_a])
 
-            # MULT
-            elif command == self.MULT:
-                reg1_address = self.ram[self.pc + 1]
-                reg2_address = self.ram[self.pc + 2]
+    def handle_prn(self, operand_a, operand_b):
+        print(self.reg[operand_a])
 
-                # self.reg[reg1_address] = self.reg[reg1_address] * self.reg[reg2_address]
-                self.reg[reg1_address] *= self.reg[reg2_address]
+    def handle_pra(self, operand_a, operand_b):
+        print(chr(self.reg[operand_a]), end='')
 
-            elif command == self.PUSH:
-                self.reg[7] -= 1
+    # ALU
 
-                register_address = self.ram[self.pc + 1]
-                value = self.reg[register_address]
+    def handle_add(self, operand_a, operand_b):
+        # self.alu('ADD', operand_a, operand_b)
+        self.reg[operand_a] += self.reg[operand_b]
 
-                SP = self.reg[7]
-                self.ram[SP] = value
+    def handle_sub(self, operand_a, operand_b):
+        self.reg[operand_a] -= self.reg[operand_b]
 
-            elif command == self.POP:
-                SP = self.reg[7]
+    def handle_mul(self, operand_a, operand_b):
+        self.reg[operand_a] *= self.reg[operand_b]
 
-                value = self.ram[SP]
+    def handle_div(self, operand_a, operand_b):
+        if self.reg[operand_b] == 0:
+            print('Error: division by zero')
+            self.running = False
+            return
 
-                register_address = self.ram[self.pc + 1]
+        self.reg[operand_a] //= self.reg[operand_b]
 
-                self.reg[register_address] = value
+    def handle_mod(self, operand_a, operand_b):
+        if self.reg[operand_b] == 0:
+            print('Error: division by zero')
+            self.running = False
+            return
 
-                self.reg[7] += 1
+        self.reg[operand_a] %= self.reg[operand_b]
 
-            elif command == self.CALL:
-                # 1. push return address into Stack
-                # find the address/index of the command AFTER call
-                next_command_address = self.pc + 2
+    def handle_inc(self, operand_a, operand_b):
+        self.reg[operand_a] += 1
 
-                # push the address into Stack
-                # decrement the SP
-                self.reg[7] -= 1
+    def handle_dec(self, operand_a, operand_b):
+        self.reg[operand_a] -= 1
 
-                # put the next command address at the location in memory
-                # where the stack pointer points
-                SP = self.reg[7]
-                self.ram[SP] = next_command_address
+    def handle_cmp(self, operand_a, operand_b):
+        self.alu('CMP', operand_a, operand_b)
 
-                # 2. jump, set the PC to wherever the register says
-                # find the number of the register to look at
-                register_address = self.ram[self.pc + 1]
+    def handle_and(self, operand_a, operand_b):
+        self.reg[operand_a] &= self.reg[operand_b]
 
-                # get the address of the subroutine out of that register
-                address_to_jump = self.reg[register_address]
+    def handle_or(self, operand_a, operand_b):
+        self.reg[operand_a] |= self.reg[operand_b]
 
-                # set the pc
-                self.pc = address_to_jump
+    def handle_xor(self, operand_a, operand_b):
+        self.reg[operand_a] ^= self.reg[operand_b]
 
-            elif command == self.RET:
-                # Pop the value from the top of the stack and store it in the `PC`
+    def handle_not(self, operand_a, operand_b):
+        self.reg[operand_a] = ~self.reg[operand_a] & 0xFF
 
-                # Pop from top of stack
-                # get the value first
-                SP = self.reg[7]
-                return_address = self.ram[SP]
+    def handle_shl(self, operand_a, operand_b):
+        self.reg[operand_a] <<= self.reg[operand_b]
 
-                # then move the stack pointer back up
-                self.reg[7] += 1
+    def handle_shr(self, operand_a, operand_b):
+        self.reg[operand_a] >>= self.reg[operand_b]
 
-                # jump back, set PC to this value
-                self.pc = return_address
+    # Stack
 
-            elif command == self.CMP:
-                reg1 = self.ram_read(self.pc + 1)
-                # reg1 = self.ram[self.pc + 1]
-                reg2 = self.ram_read(self.pc + 2)
-                # reg2 = self.ram[self.pc + 2]
-                self.alu('CMP', reg1, reg2)
+    def handle_push(self, operand_a, operand_b):
+        self.reg[7] -= 1
+        self.ram_write(self.reg[operand_a], self.reg[7])
 
-            elif command == self.JEQ:
-                if self.FL[2] == 1:
-                    reg = self.ram[self.pc + 1]
-                    self.pc = self.reg[reg]
-                else:
-                    self.pc += 2
+    def handle_pop(self, operand_a, operand_b):
+        self.reg[operand_a] = self.ram_read(self.reg[7])
+        self.reg[7] += 1
 
-            elif command == self.JUMP:
-                reg = self.ram_read(self.pc + 1)
-                self.pc = self.reg[reg]
+    # Instructions that set the PC directly
 
-            elif command == self.JNE:
-                if self.FL[2] == 0:
-                    reg = self.ram[self.pc + 1]
-                    self.pc = self.reg[reg]
-                else:
-                    self.pc += 2
+    def handle_call(self, operand_a, operand_b):
+        # push the address of the instruction after CALL, then jump
+        self.reg[7] -= 1
+        self.ram_write(self.pc + 2, self.reg[7])
+        self.pc = self.reg[operand_a]
 
-            # HLT
-            elif command == self.HALT:
-                running = False
+    def handle_ret(self, operand_a, operand_b):
+        self.pc = self.ram_read(self.reg[7])
+        self.reg[7] += 1
 
-            else:
-                print('command is not recognized')
-                sys.exit(1)
+    def handle_int(self, operand_a, operand_b):
+        # set the matching bit in IS (R6)
+        self.reg[6] |= 1 << (self.reg[operand_a] & 0b111)
+        self.pc += 2
+
+    def handle_iret(self, operand_a, operand_b):
+        # pop R6-R0, then FL, then the return address
+        for i in range(6, -1, -1):
+            self.reg[i] = self.ram_read(self.reg[7])
+            self.reg[7] += 1
+
+        fl = self.ram_read(self.reg[7])
+        self.reg[7] += 1
+        self.FL[0] = (fl >> 2) & 1  # L
+        self.FL[1] = (fl >> 1) & 1  # G
+        self.FL[2] = fl & 1  # E
+
+        self.pc = self.ram_read(self.reg[7])
+        self.reg[7] += 1
+
+    def handle_jmp(self, operand_a, operand_b):
+        self.pc = self.reg[operand_a]
+
+    def jump_if(self, condition, operand_a):
+        if condition:
+            self.pc = self.reg[operand_a]
+        else:
+            self.pc += 2
+
+    def handle_jeq(self, operand_a, operand_b):
+        # If `equal` flag is set (true), jump to the address stored in the given register.
+        self.jump_if(self.FL[2] == 1, operand_a)
+
+    def handle_jne(self, operand_a, operand_b):
+        # If `E` flag is clear (false, 0), jump to the address stored in the given register.
+        self.jump_if(self.FL[2] == 0, operand_a)
+
+    def handle_jgt(self, operand_a, operand_b):
+        self.jump_if(self.FL[1] == 1, operand_a)
+
+    def handle_jlt(self, operand_a, operand_b):
+        self.jump_if(self.FL[0] == 1, operand_a)
+
+    def handle_jge(self, operand_a, operand_b):
+        self.jump_if(self.FL[1] == 1 or self.FL[2] == 1, operand_a)
+
+    def handle_jle(self, operand_a, operand_b):
+        self.jump_if(self.FL[0] == 1 or self.FL[2] == 1, operand_a)
+
+    def run(self):
+        """Run the CPU."""
+
+        self.running = True
+        # self.pc = 0
+
+        while self.running:
+            command = self.ram[self.pc]
+
+            # fetch both operand bytes up front; handlers use what they need
+            operand_a = self.ram[(self.pc + 1) & 0xFF]
+            operand_b = self.ram[(self.pc + 2) & 0xFF]
+
+            self.branchtable[command](operand_a, operand_b)
 
             number_of_operands = command >> 6
 
@@ -13,6 +13,11 @@
 #  DB 0x0a   ; a hex byte
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
+#
+# Usage: asm.py [-O] [infile.asm] [outfile.ls8]
+#
+# -O runs a peephole optimizer over the instructions before symbols are
+# resolved (see `optimize`).
 
 import sys
 import re
@@ -63,12 +68,32 @@ REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Compiled once up front, since they run on every line
+RE_LINE = re.compile(REGEX)
+RE_DS = re.compile(REGEX_DS, re.IGNORECASE)
+RE_DB = re.compile(REGEX_DB, re.IGNORECASE)
+RE_REG = re.compile(r"R([0-7])")
+
+# Opcode bytes as ints, for emitting machine code
+MACHINE_CODE = {name: int(info["code"], 2) for name, info in OPCODES.items()}
+
+
+class AsmError(Exception):
+    """A problem with the source. `status` is the exit status for main()."""
+
+    def __init__(self, message, status=1):
+        super().__init__(message)
+        self.status = status
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [-O] [inputfile] [outputfile]
     """
 
+    optimize = "-O" in argv[1:]
+    argv = [a for a in argv if a != "-O"]
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,10 +107,10 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [-O] [infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, optimize
 
 
 def open_files(inputfile, outputfile):
@@ -127,7 +152,7 @@ def p8(v):
     return "{:08b}".format(v)
 
 
-def pass1(inputfile, sym, code):
+def pass1(inputfile, sym, code, items=None, source_map=None):
     """
     Pass 1
 
@@ -135,6 +160,20 @@ def pass1(inputfile, sym, code):
     * Parse labels, opcodes, and operands
     * Record label offsets
     * Emit machine code
+
+    `code` gets one (value, comment) pair per line of output. `value` is the
+    byte, a symbol name still to be resolved, or None for a comment-only
+    line.
+
+    If `items` is a list, each label and instruction is also appended to it
+    as (opcode, op_a, op_b, lines, line number), for the optimizer. Labels
+    have opcode None and the label name in op_a; `lines` is the part of
+    `code` emitted for it.
+
+    If `source_map` is a dict, it gets the source line number of every
+    instruction and data item, keyed by address.
+
+    Raises AsmError on bad source.
     """
 
     # Source line number
@@ -143,42 +182,35 @@ def pass1(inputfile, sym, code):
     # Current code address (for labels)
     addr = 0
 
-    def get_reg(op, fatal=True):
+    def get_reg(op):
         """Get a register number from a string, e.g. "R2" -> 2"""
 
-        nonlocal line_num
-
-        m = re.match(r"R([0-7])", op)
+        m = RE_REG.match(op)
 
         if m is None:
-            if fatal:
-                print(f"Line {line_num}: unknown register {op}",
-                      file=sys.stderr)
-                sys.exit(1)
-            else:
-                return None
+            raise AsmError(f"Line {line_num}: unknown register {op}")
 
         return int(m.group(1))
 
-    def out0(opcode, op_a, op_b, machine_code):
+    def out0(opcode, op_a, op_b):
         """Handle opcodes with zero operands"""
 
         nonlocal addr
 
-        code.append(f"{machine_code} # {opcode}")
+        code.append((MACHINE_CODE[opcode], opcode))
         addr += 1
 
-    def out1(opcode, op_a, op_b, machine_code):
+    def out1(opcode, op_a, op_b):
         """Handle opcodes with one operand"""
 
         nonlocal addr
 
         reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
+        code.append((MACHINE_CODE[opcode], f"{opcode} {op_a}"))
+        code.append((reg_a, None))
         addr += 2
 
-    def out2(opcode, op_a, op_b, machine_code):
+    def out2(opcode, op_a, op_b):
         """Handle opcodes with two operands"""
 
         nonlocal addr
@@ -186,13 +218,13 @@ def pass1(inputfile, sym, code):
         reg_a = get_reg(op_a)
         reg_b = get_reg(op_b)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+        code.append((MACHINE_CODE[opcode], f"{opcode} {op_a},{op_b}"))
+        code.append((reg_a, None))
+        code.append((reg_b, None))
 
         addr += 3
 
-    def out8(opcode, op_a, op_b, machine_code):
+    def out8(opcode, op_a, op_b):
         """Handle LDI opcode (type 8)"""
 
         nonlocal addr
@@ -200,16 +232,15 @@ def pass1(inputfile, sym, code):
         reg_a = get_reg(op_a)
 
         try:
-            val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            val_b = int(op_b, 0) & 0xff
 
         except ValueError:
             # If it's not a value, it might be a symbol
-            out_b = f"sym:{op_b}"
+            val_b = op_b
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(out_b)
+        code.append((MACHINE_CODE[opcode], f"{opcode} {op_a},{op_b}"))
+        code.append((reg_a, None))
+        code.append((val_b, None))
 
         addr += 3
 
@@ -220,21 +251,20 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+        m = RE_DS.match(line)
 
         if m is None or m.group(2) is None:
-            print(f"line {line_num}: missing argument to DS", file=sys.stderr)
-            sys.exit(2)
+            raise AsmError(f"line {line_num}: missing argument to DS", 2)
 
         data = m.group(2)
 
-        for i in range(len(data)):
-            print_char = data[i]
+        for char in data:
+            print_char = char
 
             if print_char == ' ':
                 print_char = '[space]'
 
-            code.append(f"{p8(ord(data[i]))} # {print_char}")
+            code.append((ord(char) & 0xff, print_char))
 
         addr += len(data)
 
@@ -245,11 +275,10 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        m = RE_DB.match(line)
 
         if m is None or m.group(2) is None:
-            print(f"line {line}: missing argument to DB", file=sys.stderr)
-            sys.exit(2)
+            raise AsmError(f"line {line_num}: missing argument to DB", 2)
 
         data = m.group(2)
 
@@ -257,14 +286,13 @@ def pass1(inputfile, sym, code):
             val = int(data, 0)
 
         except ValueError:
-            print(f"line {line_num}: invalid integer argument to DB",
-                  file=sys.stderr)
-            sys.exit(2)
+            raise AsmError(f"line {line_num}: invalid integer argument to DB",
+                           2)
 
         # Force to byte size
         val &= 0xff
 
-        code.append(f"{p8(val)} # {data}")
+        code.append((val, data))
 
         addr += 1
 
@@ -274,18 +302,14 @@ def pass1(inputfile, sym, code):
         def check_ops_count(desired, found):
             # Makes sure we have right operand count
             if found < desired:
-                print(f"Line {line_num}: missing operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+                raise AsmError(f"Line {line_num}: missing operand to {opcode}")
             elif found > desired:
-                print(f"Line {line_num}: unexpected operand to {opcode}",
-                      file=sys.stderr)
-                sys.exit(1)
+                raise AsmError(
+                    f"Line {line_num}: unexpected operand to {opcode}")
 
         # Make sure we know this opcode at all
         if opcode not in OPCODES:
-            print(f"line {line_num}: unknown opcode {opcode}", file=sys.stderr)
-            sys.exit(2)
+            raise AsmError(f"line {line_num}: unknown opcode {opcode}", 2)
 
         op_type = OPCODES[opcode]["type"]
 
@@ -325,12 +349,12 @@ def pass1(inputfile, sym, code):
         line = line.strip()
 
         # Ignore blank lines
-        if input == '':
+        if line == '':
             continue
 
         # print(line)  # debug
 
-        m = re.match(REGEX, line)
+        m = RE_LINE.match(line)
 
         if m is not None:
             label, opcode, op_a, op_b = normalize_line(m.groups())
@@ -341,9 +365,17 @@ def pass1(inputfile, sym, code):
             if label is not None:
                 sym[label] = addr
                 # print(f"Label {label}: {addr}")  # debug
-                code.append(f'# {label} (address {addr}):')
+                code.append((None, f"{label} (address {addr}):"))
+
+                if items is not None:
+                    items.append((None, label, None, [], line_num))
 
             if opcode is not None:
+                start = len(code)
+
+                if source_map is not None:
+                    source_map[addr] = line_num
+
                 if opcode == 'DS':
                     handle_ds(line)
                 elif opcode == 'DB':
@@ -353,12 +385,209 @@ def pass1(inputfile, sym, code):
                     check_ops(opcode, op_a, op_b)
 
                     # Handle opcodes
-                    op_info = OPCODES[opcode]
-                    handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+                    handler = type_f[OPCODES[opcode]["type"]]
+                    handler(opcode, op_a, op_b)
+
+                if items is not None:
+                    items.append((opcode, op_a, op_b, code[start:], line_num))
         else:
-            print(f"No match: {input}", file=sys.stderr)
-            sys.exit(3)
+            raise AsmError(f"line {line_num}: no match: {line}", 3)
+
+
+# Instructions that write the register in their first operand
+WRITES_REG_A = {"ADD", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD", "MUL",
+                "NOT", "OR", "POP", "SHL", "SHR", "SUB", "XOR"}
+
+# Instructions that move the stack pointer (R7)
+MOVES_SP = {"CALL", "IRET", "POP", "PUSH", "RET"}
+
+# Instructions that never fall through to the next one
+NO_FALLTHROUGH = {"HLT", "IRET", "JMP", "RET"}
+
+JUMPS = {"JEQ", "JGE", "JGT", "JLE", "JLT", "JMP", "JNE"}
+
+# IS: the hardware sets its bits whenever an interrupt comes in, so what an
+# LDI left there is never known for sure
+IS = "R6"
+
+
+def ldi_value(op_b):
+    """What an LDI operand puts in the register: an int or a symbol name."""
+
+    try:
+        return int(op_b, 0) & 0xff
+    except ValueError:
+        return op_b
+
+
+def peephole(items):
+    """
+    One optimizer pass over the items from pass1. Returns (items, changed).
+
+    Everything here assumes control only reaches code by falling through or
+    by jumping to a label, so a label is where anything we know about the
+    registers gets thrown away.
+    """
+
+    out = []
+    known = {}  # register -> value an LDI is known to have left in it
+    reachable = True
+    changed = False
+
+    for i, item in enumerate(items):
+        opcode, op_a, op_b, lines, line_num = item
+
+        if opcode is None:
+            # a label: could be jumped to from anywhere
+            known = {}
+            reachable = True
+            out.append(item)
+            continue
+
+        if opcode in ("DS", "DB"):
+            # data is never removed
+            known = {}
+            out.append(item)
+            continue
+
+        # unreachable: after HLT/JMP/RET/IRET and before the next label
+        if not reachable:
+            changed = True
+            continue
+
+        # LDI of a value the register already holds
+        if opcode == "LDI" and known.get(op_a) == ldi_value(op_b):
+            changed = True
+            continue
+
+        # PUSH R followed by POP R
+        if (opcode == "POP" and out and out[-1][0] == "PUSH"
+                and out[-1][1] == op_a):
+            out.pop()
+            changed = True
+            continue
+
+        # jump to the instruction right after it
+        if opcode in JUMPS and op_a in known:
+            j = i + 1
+
+            while j < len(items) and items[j][0] is None:
+                if items[j][1] == known[op_a]:
+                    break
+                j += 1
+            else:
+                j = None
+
+            if j is not None:
+                changed = True
+                continue
+
+        out.append(item)
+
+        # keep track of what's in the registers
+        if opcode == "LDI" and op_a != IS:
+            known[op_a] = ldi_value(op_b)
+        elif opcode in ("CALL", "INT"):
+            # the subroutine or handler could change anything
+            known = {}
+        elif opcode in WRITES_REG_A:
+            known.pop(op_a, None)
+
+        if opcode in MOVES_SP:
+            known.pop("R7", None)
+
+        if opcode in NO_FALLTHROUGH:
+            reachable = False
+
+    return out, changed
+
+
+def optimize(items):
+    """
+    Peephole optimizer for -O.
+
+    Repeats these until nothing changes:
+
+    * drop LDIs that load a register with the value it already has
+    * drop PUSH R immediately followed by POP R
+    * drop jumps to the instruction right after them
+    * drop unreachable code after HLT, JMP, RET and IRET
+
+    Returns the new item list.
+    """
+
+    changed = True
+
+    while changed:
+        items, changed = peephole(items)
+
+    return items
+
+
+def layout(items, sym, code, source_map=None):
+    """Rebuild the machine code and label addresses from `items`."""
+
+    sym.clear()
+    code.clear()
+
+    if source_map is not None:
+        source_map.clear()
+
+    addr = 0
+
+    for opcode, op_a, op_b, lines, line_num in items:
+        if opcode is None:
+            sym[op_a] = addr
+            code.append((None, f"{op_a} (address {addr}):"))
+        else:
+            if source_map is not None:
+                source_map[addr] = line_num
+
+            code.extend(lines)
+            addr += len(lines)
+
+
+def assemble_lines(inputfile, sym, code, source_map=None, optimized=False):
+    """
+    Run pass 1 over `inputfile` (any iterable of lines), then the optimizer
+    if `optimized`.
+
+    Returns (instructions saved, bytes saved) by the optimizer.
+    """
+
+    if not optimized:
+        pass1(inputfile, sym, code, source_map=source_map)
+        return 0, 0
+
+    items = []
+    pass1(inputfile, sym, code, items)
+
+    size = code_size(code)
+    count = sum(1 for item in items if item[0] is not None)
+
+    items = optimize(items)
+    layout(items, sym, code, source_map)
+
+    saved = count - sum(1 for item in items if item[0] is not None)
+
+    return saved, size - code_size(code)
+
+
+def code_size(code):
+    """Number of bytes of machine code in `code`."""
+    return sum(1 for value, comment in code if value is not None)
+
+
+def symbol_value(value, sym):
+    """Look up `value` in the symbol table if it's a symbol name."""
+
+    if isinstance(value, str):
+        if value not in sym:
+            raise AsmError(f"unknown symbol: {value}", 2)
+
+        return sym[value]
+
+    return value
 
 
 def pass2(outputfile, sym, code):
@@ -366,24 +595,52 @@ def pass2(outputfile, sym, code):
     Output the code, substituting in any symbols.
     """
 
-    for c in code:
-        # Replace symbols
-        if c[:4] == 'sym:':
-            s = c[4:].strip()
+    for value, comment in code:
+        if value is None:
+            outputfile.write(f"# {comment}\n")
+            continue
 
-            if s in sym:
-                c = p8(sym[s])
+        # Replace symbols
+        c = p8(symbol_value(value, sym))
 
-            else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+        if comment is not None:
+            c += f" # {comment}"
 
         outputfile.write(f"{c}\n")
 
 
+def resolve(code, sym):
+    """Like pass2, but produce the machine code as bytes."""
+
+    return bytes(symbol_value(value, sym)
+                 for value, comment in code if value is not None)
+
+
+def assemble(source, sym=None, source_map=None, optimized=False):
+    """
+    Assemble `source` (a string) straight to machine code bytes, ready for
+    CPU.load_program().
+
+    Pass dicts as `sym` and `source_map` to get the symbol table (label ->
+    address) and the source line of each address. With `optimized`, run
+    the -O optimizer too.
+
+    Raises AsmError on bad source.
+    """
+
+    if sym is None:
+        sym = {}
+
+    code = []
+    assemble_lines(source.splitlines(), sym, code, source_map, optimized)
+
+    return resolve(code, sym)
+
+
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, optimizing = parse_commandline(argv)
+    filename = inputfile
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
@@ -395,8 +652,19 @@ def main(argv):
     code = []
 
     # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    try:
+        saved, saved_bytes = assemble_lines(inputfile, sym, code,
+                                            optimized=optimizing)
+
+        if optimizing:
+            print(f"{filename}: -O saved {saved} instructions, "
+                  f"{saved_bytes} bytes", file=sys.stderr)
+
+        pass2(outputfile, sym, code)
+
+    except AsmError as e:
+        print(e, file=sys.stderr)
+        return e.status
 
     return 0
 
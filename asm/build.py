@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# Build driver: assembles many .asm files at once
+#
+# Each source is assembled to a .ls8 file of the same name in the output
+# directory. Sources are split across a pool of processes, each of which
+# imports the assembler once and then works through its share, instead of
+# starting a new `python asm.py` per file.
+#
+# A manifest in the output directory records, per source, the hash of its
+# contents and the assembler version it was built with. A source whose
+# hash and version both match, and whose output is still there, is
+# skipped. Editing asm.py changes the version, so everything is rebuilt.
+#
+# Usage: build.py [-O] [-j N] [--force] [--out DIR] [source.asm ...]
+#
+# With no sources, builds every .asm file next to this script into
+# ../ls8/examples (what `buildall` used to do).
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST = ".build-manifest.json"
+
+# Below this many stale files, starting a process pool costs more than it
+# saves
+PARALLEL_THRESHOLD = 16
+
+
+def assembler_version(optimized):
+    """Identifies the assembler: a hash of asm.py, plus the flags used."""
+
+    with open(asm.__file__, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    return digest + ("-O" if optimized else "")
+
+
+def source_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def output_name(source, outdir):
+    name = os.path.splitext(os.path.basename(source))[0] + ".ls8"
+    return os.path.join(outdir, name)
+
+
+def build_one(job):
+    """
+    Assemble one source to its .ls8 output.
+
+    Returns (source, error message or None).
+    """
+
+    source, output, optimized = job
+
+    sym = {}
+    code = []
+    text = io.StringIO()
+
+    try:
+        with open(source) as f:
+            asm.assemble_lines(f, sym, code, optimized=optimized)
+
+        asm.pass2(text, sym, code)
+
+    except (asm.AsmError, OSError) as e:
+        return source, str(e)
+
+    # write then rename, so an interrupted build never leaves half a file
+    # that the manifest says is up to date
+    temp = output + ".tmp"
+
+    with open(temp, "w") as f:
+        f.write(text.getvalue())
+
+    os.replace(temp, output)
+
+    return source, None
+
+
+def load_manifest(outdir):
+    try:
+        with open(os.path.join(outdir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(outdir, manifest):
+    path = os.path.join(outdir, MANIFEST)
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(path + ".tmp", path)
+
+
+def build(sources, outdir, optimized=False, workers=None, force=False):
+    """
+    Assemble whichever of `sources` are out of date.
+
+    Returns (built, skipped, errors) where errors is a list of
+    (source, message).
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+
+    version = assembler_version(optimized)
+    manifest = {} if force else load_manifest(outdir)
+
+    jobs = []
+    hashes = {}
+    skipped = 0
+
+    for source in sources:
+        key = os.path.abspath(source)
+        output = output_name(source, outdir)
+        hashes[key] = source_hash(source)
+
+        entry = manifest.get(key)
+
+        if (entry is not None and entry["hash"] == hashes[key]
+                and entry["assembler"] == version
+                and os.path.exists(output)):
+            skipped += 1
+            continue
+
+        jobs.append((source, output, optimized))
+
+    if len(jobs) < PARALLEL_THRESHOLD or workers == 1:
+        results = [build_one(job) for job in jobs]
+    else:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (workers * 4))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(build_one, jobs, chunksize=chunksize))
+
+    errors = []
+
+    for source, error in results:
+        key = os.path.abspath(source)
+
+        if error is None:
+            manifest[key] = {"hash": hashes[key], "assembler": version}
+        else:
+            # make sure a broken source gets another go next time
+            manifest.pop(key, None)
+            errors.append((source, error))
+
+    save_manifest(outdir, manifest)
+
+    return len(results) - len(errors), skipped, errors
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build LS-8 programs")
+    parser.add_argument("sources", nargs="*",
+                        help="source files (default: every .asm here)")
+    parser.add_argument("-O", dest="optimized", action="store_true",
+                        help="run the peephole optimizer")
+    parser.add_argument("-j", dest="workers", type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild everything, ignoring the manifest")
+    parser.add_argument("--out",
+                        default=os.path.join(HERE, "..", "ls8", "examples"),
+                        help="output directory")
+    args = parser.parse_args(argv[1:])
+
+    sources = args.sources or sorted(glob.glob(os.path.join(HERE, "*.asm")))
+
+    built, skipped, errors = build(sources, args.out, args.optimized,
+                                   args.workers, args.force)
+
+    for source, error in errors:
+        print(f"{source}: {error}", file=sys.stderr)
+
+    print(f"{built} built, {skipped} up to date, {len(errors)} failed")
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,307 @@
+"""Run many LS-8 machines in lockstep with NumPy."""
+
+# Every machine gets a row in each array:
+#
+#   reg  (N, 8)   uint8   general-purpose registers
+#   ram  (N, 256) uint8   memory
+#   pc   (N,)     uint8   program counters
+#   fl   (N,)     uint8   flags, `00000LGE`
+#
+# `step()` fetches the instruction under every machine's PC at once, then
+# runs each distinct opcode once over the rows that are executing it. That
+# way machines whose PCs have drifted apart (different branches taken, ...)
+# still advance together, they just end up in more than one opcode group.
+#
+# uint8 arithmetic wraps around at 256 on its own, matching the spec.
+#
+# Interrupts work as in the CPU: before each instruction, any machine with
+# interrupts enabled and a bit set in both IM (R5) and IS (R6) enters the
+# handler for the lowest such bit. There are no devices, so only INT (or a
+# program writing IS itself) ever raises one.
+
+import numpy as np
+
+from cpu import CPU, IM, IS, VECTORS
+
+# Opcode -> mnemonic, taken from the CPU's branch table so the two emulators
+# always agree on the instruction set
+OPCODES = {
+    opcode: handler.__name__[len("handle_"):]
+    for opcode, handler in enumerate(CPU.branchtable)
+    if handler.__name__ != "handle_unknown"
+}
+
+# Pending interrupt bits -> the number of the one to dispatch (lowest first)
+# (0 has none; it's never looked up)
+LOWEST = np.array([max((i & -i).bit_length() - 1, 0) for i in range(256)],
+                  dtype=np.uint8)
+
+
+class BatchCPU:
+    """N LS-8 machines stepped together."""
+
+    def __init__(self, n):
+        """Construct `n` machines in the power-on state."""
+        self.n = n
+        self.reg = np.zeros((n, 8), dtype=np.uint8)
+        self.ram = np.zeros((n, 256), dtype=np.uint8)
+        self.pc = np.zeros(n, dtype=np.uint8)
+        self.fl = np.zeros(n, dtype=np.uint8)
+        self.reg[:, 7] = 0xF4  # SP (Stack Pointer)
+
+        self.running = np.ones(n, dtype=bool)
+        self.ie = np.ones(n, dtype=bool)  # off while a handler runs
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.output = [[] for _ in range(n)]
+
+        # opcode byte -> bound handler
+        self.ops = {}
+        for opcode, name in OPCODES.items():
+            self.ops[opcode] = getattr(self, "op_" + name)
+
+    def load(self, program, address=0):
+        """Copy the same program bytes into every machine's RAM."""
+        program = np.frombuffer(bytes(program), dtype=np.uint8)
+        self.ram[:, address:address + len(program)] = program
+
+    def step(self):
+        """Run one instruction on every machine that hasn't halted."""
+
+        rows = np.flatnonzero(self.running)
+
+        if len(rows) == 0:
+            return False
+
+        pending = self.reg[:, IM] & self.reg[:, IS]
+        interrupted = np.flatnonzero(pending.astype(bool) & self.ie &
+                                     self.running)
+
+        if len(interrupted):
+            self.dispatch(interrupted, LOWEST[pending[interrupted]])
+
+        pc = self.pc[rows]
+        ir = self.ram[rows, pc]
+        operand_a = self.ram[rows, (pc + 1) & 0xFF]
+        operand_b = self.ram[rows, (pc + 2) & 0xFF]
+
+        # advance the PC first, like CPU.run(); jumps overwrite it
+        next_pc = (pc + 1 + (ir >> 6)).astype(np.uint8)
+        self.pc[rows] = next_pc
+        self.cycles[rows] += 1
+
+        for opcode in np.unique(ir):
+            group = ir == opcode
+            handler = self.ops.get(int(opcode))
+            if handler is None:
+                self.unknown(rows[group], int(opcode), pc[group])
+                continue
+
+            # register operands only have 3 bits
+            handler(rows[group],
+                    operand_a[group] & 0b111,
+                    operand_b[group],
+                    next_pc[group])
+
+        return True
+
+    def run(self, max_steps=None):
+        """Step until every machine halts (or `max_steps` is reached)."""
+
+        steps = 0
+
+        while self.step():
+            steps += 1
+            if max_steps is not None and steps >= max_steps:
+                break
+
+    def results(self):
+        """Per-machine output and final state, as a list of dicts."""
+
+        return [
+            {
+                "output": "".join(self.output[i]),
+                "reg": self.reg[i].tolist(),
+                "pc": int(self.pc[i]),
+                "fl": int(self.fl[i]),
+                "cycles": int(self.cycles[i]),
+                "halted": not self.running[i],
+            }
+            for i in range(self.n)
+        ]
+
+    def dispatch(self, rows, numbers):
+        """Enter interrupt handler `numbers` on `rows`, like CPU.dispatch."""
+
+        self.ie[rows] = False
+        self.reg[rows, IS] &= ~np.left_shift(1, numbers, dtype=np.uint8)
+
+        # PC, FL, then R0-R6; IRET pops them in the opposite order
+        self.push(rows, self.pc[rows])
+        self.push(rows, self.fl[rows])
+
+        for i in range(7):
+            self.push(rows, self.reg[rows, i])
+
+        self.pc[rows] = self.ram[rows, VECTORS + numbers]
+
+    # Opcode handlers
+    #
+    # Each gets the rows executing it, operand_a (already masked down to a
+    # register number), operand_b and the fall-through PC for those rows.
+
+    def unknown(self, rows, opcode, pc):
+        for i, address in zip(rows, pc):
+            self.output[i].append(
+                f"Unknown instruction {opcode:08b} at address {address:02X}\n")
+        self.running[rows] = False
+
+    def op_nop(self, rows, a, b, next_pc):
+        pass
+
+    def op_hlt(self, rows, a, b, next_pc):
+        self.running[rows] = False
+
+    def op_ldi(self, rows, a, b, next_pc):
+        self.reg[rows, a] = b
+
+    def op_ld(self, rows, a, b, next_pc):
+        self.reg[rows, a] = self.ram[rows, self.reg[rows, b & 0b111]]
+
+    def op_st(self, rows, a, b, next_pc):
+        self.ram[rows, self.reg[rows, a]] = self.reg[rows, b & 0b111]
+
+    def op_prn(self, rows, a, b, next_pc):
+        for i, value in zip(rows, self.reg[rows, a]):
+            self.output[i].append(f"{value}\n")
+
+    def op_pra(self, rows, a, b, next_pc):
+        for i, value in zip(rows, self.reg[rows, a]):
+            self.output[i].append(chr(value))
+
+    # ALU
+
+    def alu(self, rows, a, b, function):
+        b = b & 0b111
+        self.reg[rows, a] = function(self.reg[rows, a], self.reg[rows, b])
+
+    def op_add(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.add)
+
+    def op_sub(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.subtract)
+
+    def op_mul(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.multiply)
+
+    def op_and(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.bitwise_and)
+
+    def op_or(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.bitwise_or)
+
+    def op_xor(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.bitwise_xor)
+
+    def op_shl(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.left_shift)
+
+    def op_shr(self, rows, a, b, next_pc):
+        self.alu(rows, a, b, np.right_shift)
+
+    def divide(self, rows, a, b, function):
+        b = b & 0b111
+        divisor = self.reg[rows, b]
+        zero = divisor == 0
+
+        # same as the CPU: print an error and halt just those machines
+        for i in rows[zero]:
+            self.output[i].append("Error: division by zero\n")
+        self.running[rows[zero]] = False
+
+        ok = ~zero
+        rows, a, b = rows[ok], a[ok], b[ok]
+        self.reg[rows, a] = function(self.reg[rows, a], self.reg[rows, b])
+
+    def op_div(self, rows, a, b, next_pc):
+        self.divide(rows, a, b, np.floor_divide)
+
+    def op_mod(self, rows, a, b, next_pc):
+        self.divide(rows, a, b, np.remainder)
+
+    def op_inc(self, rows, a, b, next_pc):
+        self.reg[rows, a] += 1
+
+    def op_dec(self, rows, a, b, next_pc):
+        self.reg[rows, a] -= 1
+
+    def op_not(self, rows, a, b, next_pc):
+        self.reg[rows, a] = ~self.reg[rows, a]
+
+    def op_cmp(self, rows, a, b, next_pc):
+        x = self.reg[rows, a]
+        y = self.reg[rows, b & 0b111]
+        self.fl[rows] = np.where(x < y, 0b100, np.where(x > y, 0b010, 0b001))
+
+    # Stack
+
+    def push(self, rows, values):
+        self.reg[rows, 7] -= 1
+        self.ram[rows, self.reg[rows, 7]] = values
+
+    def pop(self, rows):
+        values = self.ram[rows, self.reg[rows, 7]]
+        self.reg[rows, 7] += 1
+        return values
+
+    def op_push(self, rows, a, b, next_pc):
+        # read the register after SP moves, same as the CPU
+        self.reg[rows, 7] -= 1
+        self.ram[rows, self.reg[rows, 7]] = self.reg[rows, a]
+
+    def op_pop(self, rows, a, b, next_pc):
+        self.reg[rows, a] = self.ram[rows, self.reg[rows, 7]]
+        self.reg[rows, 7] += 1
+
+    # Instructions that set the PC directly
+
+    def op_call(self, rows, a, b, next_pc):
+        self.push(rows, next_pc)
+        self.pc[rows] = self.reg[rows, a]
+
+    def op_ret(self, rows, a, b, next_pc):
+        self.pc[rows] = self.pop(rows)
+
+    def op_int(self, rows, a, b, next_pc):
+        self.reg[rows, 6] |= np.left_shift(1, self.reg[rows, a] & 0b111,
+                                           dtype=np.uint8)
+
+    def op_iret(self, rows, a, b, next_pc):
+        for i in range(6, -1, -1):
+            self.reg[rows, i] = self.pop(rows)
+        self.fl[rows] = self.pop(rows)
+        self.pc[rows] = self.pop(rows)
+        self.ie[rows] = True
+
+    def op_jmp(self, rows, a, b, next_pc):
+        self.pc[rows] = self.reg[rows, a]
+
+    def jump_if(self, rows, a, condition):
+        self.pc[rows[condition]] = self.reg[rows[condition], a[condition]]
+
+    def op_jeq(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b001) != 0)
+
+    def op_jne(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b001) == 0)
+
+    def op_jgt(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b010) != 0)
+
+    def op_jlt(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b100) != 0)
+
+    def op_jge(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b011) != 0)
+
+    def op_jle(self, rows, a, b, next_pc):
+        self.jump_if(rows, a, (self.fl[rows] & 0b101) != 0)
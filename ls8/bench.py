@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""Emulator benchmarks."""
+
+# Runs a set of workloads through every execution engine and reports, per
+# workload and engine:
+#
+#   mips          millions of LS-8 instructions per second of run() time
+#   ns_per_instr  host nanoseconds per LS-8 instruction
+#   startup_us    microseconds to construct a CPU and load the program
+#
+# Workloads are a few synthetic long-running programs (a counter loop,
+# nested CALLs, a memory sweep) plus the example programs that halt on their
+# own. Output goes to a NullSink so printing doesn't skew the numbers.
+#
+# Results can be saved as a JSON baseline and later runs compared against
+# it; any workload/engine whose MIPS drops more than --threshold below the
+# baseline is reported and the exit status is 1.
+#
+# Usage: bench.py [--repeat N] [--min-time SECONDS] [--engines a,b]
+#                 [--save FILE] [--compare FILE] [--threshold FRACTION]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from cpu import CPU
+from sinks import NullSink
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "examples")
+
+# Examples that halt on their own (the rest wait for interrupts or run away)
+EXAMPLE_PROGRAMS = ["call", "mult", "print8", "printstr", "sctest", "stack"]
+
+ENGINES = ["interpreter", "blocks", "batch"]
+
+# How many machines the NumPy batch engine runs at once
+BATCH_SIZE = 64
+
+
+def counter_loop(outer=100, inner=200):
+    """Two nested counting loops: ADD/CMP/JNE over and over."""
+
+    return bytes([
+        0x82, 0x04, 0x00,   # 00 LDI R4,0       outer counter
+        0x82, 0x05, 0x01,   # 03 LDI R5,1
+        0x82, 0x06, outer,  # 06 LDI R6,outer
+        0x82, 0x02, inner,  # 09 LDI R2,inner
+        0x82, 0x01, 0x01,   # 0C LDI R1,1
+        0x82, 0x00, 0x00,   # 0F Outer: LDI R0,0
+        0x82, 0x03, 0x15,   # 12 LDI R3,Inner
+        0xA0, 0x00, 0x01,   # 15 Inner: ADD R0,R1
+        0xA7, 0x00, 0x02,   # 18 CMP R0,R2
+        0x56, 0x03,         # 1B JNE R3
+        0xA0, 0x04, 0x05,   # 1D ADD R4,R5
+        0xA7, 0x04, 0x06,   # 20 CMP R4,R6
+        0x82, 0x03, 0x0F,   # 23 LDI R3,Outer
+        0x56, 0x03,         # 26 JNE R3
+        0x01,               # 28 HLT
+    ])
+
+
+def nested_calls():
+    """256 rounds of CALL -> CALL -> CALL, with PUSH/POP in each level."""
+
+    return bytes([
+        0x82, 0x00, 0x00,   # 00 LDI R0,0       counter, wraps after 256
+        0x82, 0x01, 0x01,   # 03 LDI R1,1
+        0x82, 0x02, 0x00,   # 06 LDI R2,0
+        0x82, 0x03, 0x1A,   # 09 LDI R3,A
+        0x82, 0x04, 0x0F,   # 0C LDI R4,Loop
+        0x50, 0x03,         # 0F Loop: CALL R3
+        0xA0, 0x00, 0x01,   # 11 ADD R0,R1
+        0xA7, 0x00, 0x02,   # 14 CMP R0,R2
+        0x56, 0x04,         # 17 JNE R4
+        0x01,               # 19 HLT
+        0x45, 0x03,         # 1A A: PUSH R3
+        0x82, 0x03, 0x24,   # 1C LDI R3,B
+        0x50, 0x03,         # 1F CALL R3
+        0x46, 0x03,         # 21 POP R3
+        0x11,               # 23 RET
+        0x45, 0x03,         # 24 B: PUSH R3
+        0x82, 0x03, 0x2E,   # 26 LDI R3,C
+        0x50, 0x03,         # 29 CALL R3
+        0x46, 0x03,         # 2B POP R3
+        0x11,               # 2D RET
+        0x45, 0x00,         # 2E C: PUSH R0
+        0x46, 0x00,         # 30 POP R0
+        0x11,               # 32 RET
+    ])
+
+
+def memory_sweep(sweeps=40):
+    """Store and load every byte from 0x80 to 0xEF, `sweeps` times."""
+
+    return bytes([
+        0x82, 0x01, 0x01,    # 00 LDI R1,1
+        0x82, 0x02, 0xF0,    # 03 LDI R2,0xF0
+        0x82, 0x05, 0x00,    # 06 LDI R5,0       sweeps done
+        0x82, 0x06, sweeps,  # 09 LDI R6,sweeps
+        0x82, 0x00, 0x80,    # 0C Sweep: LDI R0,0x80
+        0x82, 0x03, 0x12,    # 0F LDI R3,Loop
+        0x84, 0x00, 0x04,    # 12 Loop: ST R0,R4
+        0x83, 0x04, 0x00,    # 15 LD R4,R0
+        0xA0, 0x04, 0x01,    # 18 ADD R4,R1
+        0xA0, 0x00, 0x01,    # 1B ADD R0,R1
+        0xA7, 0x00, 0x02,    # 1E CMP R0,R2
+        0x56, 0x03,          # 21 JNE R3
+        0xA0, 0x05, 0x01,    # 23 ADD R5,R1
+        0xA7, 0x05, 0x06,    # 26 CMP R5,R6
+        0x82, 0x03, 0x0C,    # 29 LDI R3,Sweep
+        0x56, 0x03,          # 2C JNE R3
+        0x01,                # 2E HLT
+    ])
+
+
+def workloads():
+    """Name -> program bytes for every benchmark workload."""
+
+    programs = {
+        "counter_loop": counter_loop(),
+        "nested_calls": nested_calls(),
+        "memory_sweep": memory_sweep(),
+    }
+
+    for name in EXAMPLE_PROGRAMS:
+        cpu = CPU()
+        cpu.load_file(os.path.join(EXAMPLES, name + ".ls8"))
+        programs[name] = bytes(cpu.ram)
+
+    return programs
+
+
+def bench_cpu(program, engine, repeat, min_time):
+    """
+    Time runs of `program` on a fresh CPU each time.
+
+    Runs at least `repeat` times and until `min_time` seconds of run() time
+    have built up, so tiny programs still get a stable measurement.
+
+    Returns (instructions, run time, startup time, runs).
+    """
+
+    startup = run_time = 0
+    instructions = runs = 0
+
+    while runs < repeat or run_time < min_time:
+        runs += 1
+        start = time.perf_counter()
+        cpu = CPU(engine=engine, sink=NullSink())
+        cpu.load_program(program)
+        startup += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cpu.run()
+        run_time += time.perf_counter() - start
+
+        instructions += cpu.cycles
+
+    return instructions, run_time, startup, runs
+
+
+def bench_batch(program, repeat, min_time):
+    """Like bench_cpu(), but each run is BATCH_SIZE machines in lockstep."""
+
+    from batch import BatchCPU
+
+    startup = run_time = 0
+    instructions = runs = 0
+
+    while runs < repeat or run_time < min_time:
+        runs += 1
+        start = time.perf_counter()
+        machines = BatchCPU(BATCH_SIZE)
+        machines.load(program)
+        startup += time.perf_counter() - start
+
+        start = time.perf_counter()
+        machines.run()
+        run_time += time.perf_counter() - start
+
+        instructions += int(machines.cycles.sum())
+
+    # startup per machine, to compare with one CPU
+    return instructions, run_time, startup / BATCH_SIZE, runs
+
+
+def bench(engines=ENGINES, repeat=5, min_time=0.2):
+    """Run every workload on every engine. Returns the results dict."""
+
+    results = {}
+
+    for name, program in workloads().items():
+        results[name] = {}
+
+        for engine in engines:
+            if engine == "batch":
+                try:
+                    import numpy  # noqa: F401
+                except ImportError:
+                    continue
+                timing = bench_batch(program, repeat, min_time)
+            else:
+                timing = bench_cpu(program, engine, repeat, min_time)
+
+            instructions, run_time, startup, runs = timing
+
+            results[name][engine] = {
+                "instructions": instructions,
+                "mips": instructions / run_time / 1e6,
+                "ns_per_instr": run_time / instructions * 1e9,
+                "startup_us": startup / runs * 1e6,
+            }
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """(workload, engine) pairs that got more than `threshold` slower."""
+
+    regressions = []
+
+    for name, engines in results.items():
+        for engine, now in engines.items():
+            before = baseline.get(name, {}).get(engine)
+
+            if before is None:
+                continue
+
+            if now["mips"] < before["mips"] * (1 - threshold):
+                regressions.append((name, engine, before["mips"], now["mips"]))
+
+    return regressions
+
+
+def print_results(results):
+    print(f"{'workload':<14} {'engine':<12} {'MIPS':>8} {'ns/instr':>9} "
+          f"{'startup us':>11}")
+
+    for name, engines in results.items():
+        for engine, r in engines.items():
+            print(f"{name:<14} {engine:<12} {r['mips']:8.3f} "
+                  f"{r['ns_per_instr']:9.1f} {r['startup_us']:11.1f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="LS-8 emulator benchmarks")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="minimum runs per workload and engine")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum seconds of run time per measurement")
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help="comma-separated engines to run")
+    parser.add_argument("--save", metavar="FILE",
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown vs. the baseline (0.10 = 10%%)")
+    args = parser.parse_args(argv[1:])
+
+    results = bench(args.engines.split(","), args.repeat, args.min_time)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+
+        for name, engine, before, now in regressions:
+            print(f"REGRESSION: {name} on {engine}: "
+                  f"{before:.3f} -> {now:.3f} MIPS")
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
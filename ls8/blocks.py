@@ -0,0 +1,240 @@
+"""Basic-block translator: turns runs of LS-8 code into Python functions."""
+
+# A basic block starts at whatever address the PC lands on and runs up to and
+# including the next instruction that sets the PC (JMP, JEQ, JNE, CALL, RET,
+# ...) or halts. Each block is turned into the source of one Python function,
+# compiled once, and from then on the whole block runs as a single call.
+#
+# Generated functions take (cpu, reg, ram, code), leave `cpu.pc` pointing at
+# the next instruction to run and return how many instructions they ran.
+
+from collections import OrderedDict
+
+from cpu import (
+    ADD, AND, CALL, CMP, DEC, DIV, HLT, IM, INC, IS, JEQ, JGE, JGT, JLE, JLT,
+    JMP, JNE, LD, LDI, MOD, MUL, NOP, NOT, OR, POP, PRA, PRN, PUSH,
+    REGISTER_WRITES, RET, SHL, SHR, ST, SUB, XOR,
+)
+
+# Longest block we'll translate before falling through into another one
+MAX_BLOCK = 64
+
+# Straight-line instructions: Python statement templates. Results are masked
+# to 8 bits, same as the interpreter's handlers.
+SIMPLE = {
+    NOP: None,
+    LDI: "reg[{a}] = {b}",
+    LD: "reg[{a}] = ram[reg[{b}]]",
+    ADD: "reg[{a}] = (reg[{a}] + reg[{b}]) & 0xFF",
+    SUB: "reg[{a}] = (reg[{a}] - reg[{b}]) & 0xFF",
+    MUL: "reg[{a}] = (reg[{a}] * reg[{b}]) & 0xFF",
+    AND: "reg[{a}] &= reg[{b}]",
+    OR: "reg[{a}] |= reg[{b}]",
+    XOR: "reg[{a}] ^= reg[{b}]",
+    NOT: "reg[{a}] = ~reg[{a}] & 0xFF",
+    SHL: "reg[{a}] = (reg[{a}] << reg[{b}]) & 0xFF",
+    SHR: "reg[{a}] >>= reg[{b}]",
+    INC: "reg[{a}] = (reg[{a}] + 1) & 0xFF",
+    DEC: "reg[{a}] = (reg[{a}] - 1) & 0xFF",
+    POP: "reg[{a}] = ram[reg[7]]\n{i}reg[7] = (reg[7] + 1) & 0xFF",
+    PRN: "cpu.handle_prn({a}, 0)",
+    PRA: "cpu.handle_pra({a}, 0)",
+}
+
+# Conditional jumps: the FL bits that must be set (or clear, for JNE)
+CONDITIONS = {
+    JEQ: "cpu.fl & 0b001",
+    JNE: "not cpu.fl & 0b001",
+    JGT: "cpu.fl & 0b010",
+    JLT: "cpu.fl & 0b100",
+    JGE: "cpu.fl & 0b011",
+    JLE: "cpu.fl & 0b101",
+}
+
+# Compiled functions keyed by their source text. The source only depends on
+# the bytes in the block and where it starts, so CPUs running the same
+# program share the compiled code. Least recently used ones are dropped past
+# COMPILED_MAX, so self-modifying code or a long stream of different
+# programs can't grow it forever; CPUs keep the blocks they're using in
+# their own cpu.blocks either way.
+COMPILED_MAX = 4096
+_compiled = OrderedDict()
+
+
+def _write(lines, indent, address, value, next_pc, count):
+    """Emit a RAM write that bails out of the block if it hits code."""
+
+    lines.append(f"{indent}addr = {address}")
+    lines.append(f"{indent}ram[addr] = {value}")
+    lines.append(f"{indent}if code >> addr & 1:")
+    lines.append(f"{indent}    cpu.invalidate(addr)")
+    # the rest of this block may be stale now, so leave and retranslate
+    lines.append(f"{indent}    cpu.pc = {next_pc}")
+    lines.append(f"{indent}    return {count}")
+
+
+def _idle_check(lines, indent, start):
+    """
+    Emit the check for an idle loop: NOPs, if any, then a jump back to the
+    block's own start. That can only spin until an interrupt, so flag it
+    for CPU.skip_idle.
+    """
+
+    lines.append(f"{indent}if cpu.pc == {start}:")
+    lines.append(f"{indent}    cpu.went_idle()")
+
+
+def _finish(lines, indent, end, count):
+    """Close off the function body. Returns (source, end)."""
+
+    lines.append(f"{indent}return {count}")
+    return "\n".join(lines) + "\n", end
+
+
+def translate(cpu, start):
+    """
+    Generate the source for the block starting at `start`.
+
+    Returns (source, end) where `end` is the address just past the block.
+    """
+
+    ram = cpu.ram
+    lines = [f"def block_{start:02x}(cpu, reg, ram, code):"]
+    ind = "    "
+    address = start
+    count = 0
+    # nothing but NOPs so far, so a jump back to `start` is an idle loop
+    idle = True
+
+    while count < MAX_BLOCK:
+        command = ram[address]
+        size = 1 + (command >> 6)
+
+        if address + size > 0xFF:
+            # don't translate across the end of RAM; the interpreter deals
+            # with whatever is up there
+            break
+
+        # register operands only have 3 bits; LDI's immediate has all 8
+        a = ram[(address + 1) & 0xFF] & 0b111
+        b = ram[(address + 2) & 0xFF]
+        if command != LDI:
+            b &= 0b111
+        next_pc = address + size
+        count += 1
+        lines.append(f"{ind}# {address:02X}: {command:08b}")
+
+        if command != NOP and command != JMP and command not in CONDITIONS:
+            idle = False
+
+        if command in SIMPLE:
+            if SIMPLE[command] is not None:
+                lines.append(ind + SIMPLE[command].format(a=a, b=b, i=ind))
+
+        elif command == CMP:
+            lines.append(f"{ind}x = reg[{a}]")
+            lines.append(f"{ind}y = reg[{b}]")
+            lines.append(f"{ind}cpu.fl = 0b100 if x < y else "
+                         f"0b010 if x > y else 0b001")
+
+        elif command == ST:
+            _write(lines, ind, f"reg[{a}]", f"reg[{b}]", next_pc, count)
+
+        elif command == PUSH:
+            lines.append(f"{ind}reg[7] = (reg[7] - 1) & 0xFF")
+            _write(lines, ind, "reg[7]", f"reg[{a}]", next_pc, count)
+
+        elif command in (DIV, MOD):
+            # divide by zero halts, so these go through the real handlers
+            name = "div" if command == DIV else "mod"
+            lines.append(f"{ind}cpu.handle_{name}({a}, {b})")
+            lines.append(f"{ind}if not cpu.running:")
+            lines.append(f"{ind}    cpu.pc = {next_pc}")
+            lines.append(f"{ind}    return {count}")
+
+        elif command == JMP:
+            lines.append(f"{ind}cpu.pc = reg[{a}]")
+            if idle:
+                _idle_check(lines, ind, start)
+            return _finish(lines, ind, next_pc, count)
+
+        elif command in CONDITIONS:
+            lines.append(f"{ind}cpu.pc = reg[{a}] if {CONDITIONS[command]} "
+                         f"else {next_pc}")
+            if idle:
+                _idle_check(lines, ind, start)
+            return _finish(lines, ind, next_pc, count)
+
+        elif command == CALL:
+            lines.append(f"{ind}reg[7] = (reg[7] - 1) & 0xFF")
+            lines.append(f"{ind}addr = reg[7]")
+            lines.append(f"{ind}ram[addr] = {next_pc}")
+            lines.append(f"{ind}if code >> addr & 1:")
+            lines.append(f"{ind}    cpu.invalidate(addr)")
+            lines.append(f"{ind}cpu.pc = reg[{a}]")
+            return _finish(lines, ind, next_pc, count)
+
+        elif command == RET:
+            lines.append(f"{ind}cpu.pc = ram[reg[7]]")
+            lines.append(f"{ind}reg[7] = (reg[7] + 1) & 0xFF")
+            return _finish(lines, ind, next_pc, count)
+
+        elif command == HLT:
+            lines.append(f"{ind}cpu.running = False")
+            lines.append(f"{ind}cpu.halted = True")
+            lines.append(f"{ind}cpu.pc = {next_pc}")
+            return _finish(lines, ind, next_pc, count)
+
+        else:
+            # INT, IRET and unknown opcodes end the block and go through the
+            # interpreter's handler, with the PC set up the way it expects
+            handler = cpu.branchtable[command].__name__
+            if handler == "handle_unknown":
+                a, b = command, address
+                # it exits rather than return, so count what ran before it
+                # here (but not the bad instruction, as in the interpreter)
+                lines.append(f"{ind}cpu.cycles += {count - 1}")
+            lines.append(f"{ind}cpu.pc = {next_pc}")
+            lines.append(f"{ind}cpu.{handler}({a}, {b})")
+            return _finish(lines, ind, next_pc, count)
+
+        if command in REGISTER_WRITES and a in (IM, IS):
+            # IM or IS changed, so an interrupt may be deliverable now: end
+            # the block and have the run loop check
+            lines.append(f"{ind}cpu.due = 0")
+            lines.append(f"{ind}cpu.pc = {next_pc}")
+            return _finish(lines, ind, next_pc, count)
+
+        address = next_pc
+
+    lines.append(f"{ind}cpu.pc = {address}")
+    return _finish(lines, ind, address, count)
+
+
+def compile_block(cpu, start):
+    """
+    Translate and compile the block at `start`. Returns (function, end).
+
+    The function is None if there was nothing to translate, i.e. the first
+    instruction runs off the end of RAM.
+    """
+
+    source, end = translate(cpu, start)
+
+    if end == start:
+        return None, end
+
+    function = _compiled.get(source)
+
+    if function is None:
+        namespace = {}
+        exec(compile(source, f"<ls8 block {start:02X}>", "exec"), namespace)
+        function = namespace[f"block_{start:02x}"]
+        _compiled[source] = function
+
+        if len(_compiled) > COMPILED_MAX:
+            _compiled.popitem(last=False)  # least recently used
+    else:
+        _compiled.move_to_end(source)
+
+    return function, end
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""Periodic incremental checkpoints, so a long run can pick up again."""
+
+# Every `every` cycles a Checkpointer takes a snapshot (see snapshot.py) of
+# the CPU and hands it to a background thread. That's all the run loop
+# pays for: 280 bytes copied into an immutable bytes object. The thread
+# compares it with the last one and appends to the checkpoint file only
+# what changed: the registers and the RAM pages (fork.PAGE bytes each) that
+# differ.
+#
+# Every `compact` checkpoints the file is rewritten as a single full
+# snapshot, so resuming never has more than that many deltas to apply.
+# resume() rebuilds the latest state from the file and restores it.
+#
+# File layout (little-endian): a header, b"LS8C" and a version byte, then
+# records, each a kind byte and then
+#
+#   FULL    the whole snapshot
+#   DELTA   the first STATE bytes of the snapshot (everything but RAM),
+#           a count of pages, and for each a page number and its bytes
+#
+# A record cut off by a crash is ignored, along with anything after it.
+#
+# Usage: checkpoint.py file.ckpt
+
+import os
+import queue
+import struct
+import sys
+import threading
+
+import snapshot
+from fork import PAGE, changed_pages
+
+MAGIC = b"LS8C"
+VERSION = 1
+HEADER = struct.Struct("<4sB")
+
+# record kinds
+FULL = 0
+DELTA = 1
+
+# the part of a snapshot before RAM
+STATE = snapshot.SIZE - 256
+
+
+class Checkpointer:
+    """Checkpoints `cpu` to `filename` every `every` cycles."""
+
+    def __init__(self, cpu, filename, every=1000000, compact=16, sync=True):
+        """
+        `compact`: write a full snapshot after this many checkpoints.
+        `sync`: fsync each checkpoint, so it survives the machine crashing
+        and not just the process.
+        """
+
+        self.cpu = cpu
+        self.filename = filename
+        self.every = every
+        self.compact = compact
+        self.sync = sync
+        self.stopped = False
+
+        # written to by the background thread only
+        self.last = None
+        self.count = 0
+        self.error = None
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+        cpu.schedule(cpu.cycles + every, self.checkpoint)
+
+    def checkpoint(self, cpu, cycle):
+        """The scheduled event: hand a copy of the state to the writer."""
+
+        if self.stopped:
+            return
+
+        self.queue.put(cpu.snapshot())
+        cpu.schedule(cycle + self.every, self.checkpoint)
+
+    def close(self):
+        """Take one last checkpoint, wait for the writer and stop."""
+
+        if self.stopped:
+            return
+
+        self.stopped = True
+        self.queue.put(self.cpu.snapshot())
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def writer(self):
+        while True:
+            state = self.queue.get()
+
+            if state is None:
+                return
+
+            if self.error is not None:
+                # already failed; keep draining so close() doesn't hang
+                continue
+
+            try:
+                self.write(state)
+            except OSError as e:
+                self.error = e
+
+    def write(self, state):
+        if self.last is None or self.count % self.compact == 0:
+            # start the file again from a full snapshot; the old one stays
+            # put until the new one is complete
+            temp = self.filename + ".tmp"
+
+            with open(temp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION))
+                f.write(bytes([FULL]))
+                f.write(state)
+                self.flush(f)
+
+            os.replace(temp, self.filename)
+        else:
+            pages = changed_pages(self.last[STATE:], state[STATE:])
+            record = [bytes([DELTA]), state[:STATE], bytes([len(pages)])]
+
+            for page in pages:
+                start = STATE + page * PAGE
+                record.append(bytes([page]))
+                record.append(state[start:start + PAGE])
+
+            with open(self.filename, "ab") as f:
+                f.write(b"".join(record))
+                self.flush(f)
+
+        self.last = state
+        self.count += 1
+
+    def flush(self, f):
+        f.flush()
+
+        if self.sync:
+            os.fsync(f.fileno())
+
+
+def latest(filename):
+    """
+    The most recent snapshot in checkpoint file `filename`, as bytes.
+
+    Raises ValueError if there isn't a usable one.
+    """
+
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size + 1 + snapshot.SIZE:
+        raise ValueError(f"{filename} is truncated")
+
+    magic, version = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError(f"{filename} is not an LS-8 checkpoint")
+    if version != VERSION:
+        raise ValueError(f"{filename}: unsupported checkpoint version "
+                         f"{version}")
+
+    offset = HEADER.size
+
+    if data[offset] != FULL:
+        raise ValueError(f"{filename} doesn't start with a full snapshot")
+
+    offset += 1
+    state = bytearray(data[offset:offset + snapshot.SIZE])
+    offset += snapshot.SIZE
+
+    while offset < len(data):
+        if data[offset] != DELTA or offset + 2 + STATE > len(data):
+            break
+
+        count = data[offset + 1 + STATE]
+        end = offset + 2 + STATE + count * (1 + PAGE)
+
+        if end > len(data):
+            # the last write didn't finish
+            break
+
+        state[:STATE] = data[offset + 1:offset + 1 + STATE]
+        position = offset + 2 + STATE
+
+        for i in range(count):
+            start = STATE + data[position] * PAGE
+            state[start:start + PAGE] = data[position + 1:position + 1 + PAGE]
+            position += 1 + PAGE
+
+        offset = end
+
+    state = bytes(state)
+    snapshot.unpack(state)
+
+    return state
+
+
+def resume(cpu, filename):
+    """
+    Restore `cpu` from the latest checkpoint in `filename`.
+
+    Returns False, leaving the CPU alone, if there's no checkpoint file.
+    """
+
+    if not os.path.exists(filename):
+        return False
+
+    cpu.restore(latest(filename))
+
+    return True
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: checkpoint.py file.ckpt", file=sys.stderr)
+        return 1
+
+    for line in snapshot.render(latest(argv[1])):
+        print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
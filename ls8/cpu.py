@@ -1,31 +1,186 @@
 """CPU functionality."""
 
+import functools
 import sys
+import time
+
+import image
+import loader
+import snapshot
+from events import EventQueue, NEVER
+from sinks import STDOUT
+
+# Instruction definition
+# LDI - This instruction sets a specified register to a specified value
+LDI = 0b10000010
+PRN = 0b01000111
+# HLT to be similar to Python's `exit()`
+HLT = 0b00000001
+MUL = 0b10100010
+POP = 0b01000110
+PUSH = 0b01000101
+ADD = 0b10100000
+CALL = 0b01010000
+JMP = 0b01010100
+RET = 0b00010001
+# the rest of the opcodes from asm/asm.py
+AND = 0b10101000
+CMP = 0b10100111
+DEC = 0b01100110
+DIV = 0b10100011
+INC = 0b01100101
+INT = 0b01010010
+IRET = 0b00010011
+JEQ = 0b01010101
+JGE = 0b01011010
+JGT = 0b01010111
+JLE = 0b01011001
+JLT = 0b01011000
+JNE = 0b01010110
+LD = 0b10000011
+MOD = 0b10100100
+NOP = 0b00000000
+NOT = 0b01101001
+OR = 0b10101010
+PRA = 0b01001000
+SHL = 0b10101100
+SHR = 0b10101101
+ST = 0b10000100
+SUB = 0b10100001
+XOR = 0b10101011
+
+SP = 7  # R7 is the stack pointer
+IS = 6  # R6 is the interrupt status
+IM = 5  # R5 is the interrupt mask
+
+VECTORS = 0xF8  # I0-I7 handler addresses live at F8-FF
+KEY = 0xF4  # the most recent key pressed
+
+# Instructions that write the register in their first operand. When that's
+# IM or IS, an interrupt may have just become deliverable.
+REGISTER_WRITES = {LDI, LD, POP, ADD, SUB, MUL, DIV, MOD, INC, DEC, AND, OR,
+                   XOR, NOT, SHL, SHR}
+
+# Longest decoded entry, in bytes. Plain instructions are at most 3, but a
+# fused sequence (see fusion.py) can be up to 4 POPs.
+LONGEST = 8
+
+# CPU.code with every address marked
+ALL_CODE = (1 << 256) - 1
+
+# The event queue of every CPU that hasn't scheduled anything; schedule()
+# gives a CPU its own the first time it's called. Always empty.
+NO_EVENTS = EventQueue()
 
 
 class CPU:
     """Main CPU class."""
 
-    def __init__(self):
-        """Construct a new CPU."""
-        self.reg = [0] * 8  # 8 general-purpose registers (8-bit)
-        self.ram = [0] * 256  # 256 bytes of memory
+    # Fixed attribute layout: no per-instance __dict__, and attribute access
+    # in the hot loop doesn't go through a dict lookup.
+    __slots__ = ("reg", "ram", "pc", "fl", "running", "cycles", "decoded",
+                 "code", "engine", "blocks", "sink", "profile", "tracer",
+                 "debugger", "loop", "ie", "events", "due", "halted",
+                 "limit", "fuse", "fusions", "idle",
+                 "base", "recorder")
+
+    def __init__(self, engine="interpreter", sink=None, profile=False,
+                 trace=None, fuse=True):
+        """
+        Construct a new CPU.
+
+        `engine` picks how `run()` executes code: "interpreter" runs one
+        instruction at a time, "blocks" translates basic blocks into Python
+        functions (see blocks.py) and runs a whole block per call.
+
+        `sink` is where PRN and PRA output goes (see sinks.py). The default
+        buffers it and writes it to stdout.
+
+        With `profile`, `run()` records an instruction profile (see
+        profiler.py) in `self.profile`. Profiling always steps one
+        instruction at a time, whatever the engine.
+
+        `trace` turns on the binary trace (see tracer.py): either a
+        tracer.Trace or just a depth for a new one. Tracing also steps one
+        instruction at a time.
+
+        With `fuse`, decode() fuses common instruction sequences into single
+        handlers (see fusion.py) the first time the PC reaches the start of
+        one, rather than when a program is loaded. It only applies to
+        the plain interpreter: profiling, tracing and the debugger need
+        every instruction on its own, and blocks don't use decoded entries.
+        """
+        self.reg = bytearray(8)  # 8 general-purpose registers (8-bit)
+        self.ram = bytearray(256)  # 256 bytes of memory
         self.pc = 0  # program counter
-        self.reg[7] = 0xF4  # SP (Stack Pointer)
-
-        # Instruction definition
-        # LDI - This instruction sets a specified register to a specified value
-        self.SAVE = 0b10000010  # LDI
-        self.PRINT_REG = 0b01000111
-        # HLT to be similar to Python's `exit()`
-        self.HALT = 0b00000001  # HLT
-        self.MULT = 0b10100010
-        self.POP = 0b01000110
-        self.PUSH = 0b01000101
-        self.ADD = 0b10100000
-        self.CALL = 0b01010000
-        self.JUMP = 0b01010100
-        self.RET = 0b00010001
+        self.fl = 0  # flags register, `00000LGE`
+        self.reg[SP] = 0xF4  # SP (Stack Pointer)
+        self.running = False
+        self.halted = False  # stopped for good: HLT or a fault
+        self.cycles = 0  # instructions executed so far
+        self.limit = NEVER  # cycle count the current run() stops at
+
+        # Interrupts. Timers, keyboards and so on schedule events (see
+        # events.py) against the cycle count, and the run loop only stops to
+        # look at them, or at IM/IS, once `cycles` reaches `due`.
+        self.ie = True  # interrupts enabled (off while one is serviced)
+        self.events = NO_EVENTS
+        self.due = NEVER
+        # a replay.Recorder logging interrupts and keys, if any
+        self.recorder = None
+        # spinning in a loop that only moves the PC (`Loop: JMP R0`), so
+        # nothing can happen until the next event or interrupt
+        self.idle = False
+
+        # Decoded instruction cache: address -> (handler, operand_a,
+        # operand_b, next_pc, weight), weight being how many instructions
+        # the entry stands for (more than 1 for a fused sequence). Programs
+        # almost never rewrite their own code, so each instruction is
+        # decoded once and reused until a write to one of its bytes (see
+        # `ram_write`) throws it away.
+        self.decoded = {}
+        # bytes covered by a cached instruction, so ordinary data and stack
+        # writes can skip the invalidation work entirely: bit n is set for
+        # address n (an int takes far less room than a bytearray)
+        self.code = 0
+        # the fork.Base this CPU was forked from, whose decoded instructions
+        # and blocks it can reuse
+        self.base = None
+
+        # Translated basic blocks for the "blocks" engine:
+        # start address -> (function, end address)
+        self.engine = engine
+        self.blocks = {}
+
+        self.fuse = (fuse and engine == "interpreter" and not profile
+                     and trace is None)
+        self.fusions = {}  # how many of each fused sequence decode() made
+
+        self.sink = sink if sink is not None else STDOUT
+
+        # set by debugger.Debugger while it's attached
+        self.debugger = None
+
+        # Pick the run loop once, here, so the loops themselves never have
+        # to check which optional features are turned on.
+        self.profile = None
+        self.tracer = None
+
+        if isinstance(trace, int):
+            from tracer import Trace
+            trace = Trace(trace)
+
+        if trace is not None:
+            self.tracer = trace
+            self.loop = CPU.run_traced
+        elif profile:
+            from profiler import Profile
+            self.profile = Profile()
+            self.loop = CPU.run_profiled
+        elif engine == "blocks":
+            self.loop = CPU.run_blocks
+        else:
+            self.loop = CPU.run_interpreter
 
     def ram_read(self, address):
         '''
@@ -41,6 +196,128 @@ class CPU:
         '''
         self.ram[address] = value
 
+        if self.code >> address & 1:
+            self.invalidate(address)
+
+    def mark_code(self, address, length):
+        """Mark `length` bytes from `address` (wrapping round) as code."""
+
+        bits = ((1 << length) - 1) << address
+        self.code |= (bits | bits >> 256) & ALL_CODE
+
+    def invalidate(self, address):
+        """Drop any decoded instruction that covers `address`."""
+
+        # the code changed under it, so whatever loop it was in may not be
+        # idle any more
+        self.idle = False
+
+        # entries are at most LONGEST bytes long, so only the ones starting
+        # at `address` or just before it can include it
+        for i in range(LONGEST):
+            start = (address - i) & 0xFF
+            entry = self.decoded.get(start)
+
+            if entry is None:
+                continue
+
+            # entry[3] is next_pc, so this is "address falls inside it"
+            if (address - start) & 0xFF < (entry[3] - start) & 0xFF:
+                del self.decoded[start]
+
+        for start, (function, end) in list(self.blocks.items()):
+            if start <= address < end:
+                del self.blocks[start]
+
+    def flush(self):
+        """Forget every decoded instruction, e.g. after loading a program."""
+        self.decoded.clear()
+        self.blocks.clear()
+        self.code = 0
+        self.fusions = {}
+        self.base = None
+
+    def decode(self, address):
+        """Decode the instruction at `address` and add it to the cache."""
+
+        if self.base is not None and self.debugger is None:
+            entry = self.base.entry(self.ram, address)
+
+            if entry is not None:
+                self.decoded[address] = entry
+                self.mark_code(address, entry[3] - address)
+
+                return entry
+
+        if self.fuse:
+            # the start of a common sequence gets one entry for all of it
+            # (see fusion.py). Looking here, the first time the PC gets to
+            # an address, keeps loading a program as cheap as a copy.
+            from fusion import match
+            found = match(self.ram, address)
+
+            # (one that runs off the end of RAM is left to the interpreter)
+            if found is not None and found[1][3] > address:
+                name, entry = found
+                self.fusions[name] = self.fusions.get(name, 0) + 1
+                self.decoded[address] = entry
+                self.mark_code(address, entry[3] - address)
+
+                return entry
+
+        command = self.ram[address]
+        handler = self.branchtable[command]
+        next_pc = (address + 1 + (command >> 6)) & 0xFF
+
+        if handler is CPU.handle_unknown:
+            # let the error message say what and where
+            entry = (handler, command, address, next_pc, 1)
+        else:
+            # register operands are `00000rrr`, so only the low 3 bits count
+            # (LDI's second operand is an immediate and keeps all 8)
+            operand_a = self.ram[(address + 1) & 0xFF] & 0b111
+            operand_b = self.ram[(address + 2) & 0xFF]
+
+            if command != LDI:
+                operand_b &= 0b111
+
+            entry = (handler, operand_a, operand_b, next_pc, 1)
+
+        if command in REGISTER_WRITES and operand_a in (IM, IS):
+            # after this one runs, check for interrupts
+            entry = (_checks_interrupts(handler),) + entry[1:]
+
+        if self.debugger is not None:
+            # breakpoints and watchpoints swap in their own handlers here,
+            # so only the instructions they're on pay for them
+            entry = self.debugger.patch(address, entry)
+
+        self.decoded[address] = entry
+        self.mark_code(address, 1 + (command >> 6))
+
+        return entry
+
+    def translate(self, address):
+        """Translate the basic block at `address` and add it to the cache."""
+
+        from blocks import compile_block
+
+        block = None
+
+        if self.base is not None:
+            block = self.base.block(self.ram, address)
+
+        if block is None:
+            block = compile_block(self, address)
+
+        function, end = block
+
+        if function is not None:
+            self.blocks[address] = block
+            self.mark_code(address, end - address)
+
+        return block
+
     def load(self):
         """Load a program into memory."""
 
@@ -62,55 +339,255 @@ class CPU:
             self.ram[address] = instruction
             address += 1
 
+        self.halted = False
+        self.flush()
+
     def load_ram(self):
+        '''python3 ls8.py examples/print8.ls8'''
         try:
             if len(sys.argv) < 2:
                 print(f'Error from {sys.argv[0]}: missing filename argument')
                 print(f'Usage: python3 {sys.argv[0]} <filename>')
                 sys.exit(1)
 
-            # add a counter that adds to memory at that index
-            ram_index = 0
+            self.load_file(sys.argv[1])
+
+        except FileNotFoundError:
+            print(f'Error from {sys.argv[0]}: {sys.argv[1]} not found')
+            print('Please double check the file name')
+            sys.exit(1)
 
-            with open(sys.argv[1]) as f:
-                for line in f:
-                    split_line = line.split("#")[0]
-                    strtipped_split_line = split_line.strip()
+    def load_file(self, filename, cache=None):
+        """
+        Load a program file, text `.ls8` or binary image.
 
-                    if strtipped_split_line != "":
-                        command = int(strtipped_split_line, 2)
+        Parsed programs are kept in `cache` (a loader.ProgramCache, the
+        shared `loader.cache` by default), so loading the same file again is
+        just a copy into RAM.
+        """
 
-                        # load command into memory
-                        self.ram[ram_index] = command
+        if cache is None:
+            cache = loader.cache
 
-                        ram_index += 1
+        program, entry = cache.load(filename)
+        self.load_program(program, entry)
 
-        except FileNotFoundError:
-            print(f'Error from {sys.srgv[0]}: {sys.argv[1]} not found')
-            print('Please double check the file name')
+    def load_program(self, program, entry=0):
+        """Copy program bytes into RAM at address 0 and set the PC."""
+
+        if len(program) > len(self.ram):
+            raise ValueError(f"program is {len(program)} bytes, "
+                             f"RAM is {len(self.ram)}")
+
+        self.ram[:len(program)] = program
+        self.pc = entry
+        self.halted = False
+        self.flush()
+
+    def load_image(self, filename):
+        """Load a binary program image (see image.py) and jump to its entry."""
+
+        self.pc = image.read_image(filename, self.ram)
+        self.halted = False
+        self.flush()
+
+    def fork(self, sink=None):
+        """
+        A copy of this CPU that shares its decoded code; see fork.py.
+
+        To make lots of copies, take a fork.Base once and fork that.
+        """
+
+        from fork import Base
+        return Base(self).fork(sink)
+
+    def snapshot(self):
+        """The machine state as bytes; see snapshot.py for what's in it."""
+        return snapshot.pack(self)
+
+    def restore(self, data):
+        """
+        Put the machine back in the state saved by snapshot().
+
+        `data` can be any buffer holding a snapshot, e.g. the bytes from
+        snapshot() or a file mapped by snapshot.open_snapshot().
+        """
+
+        pc, fl, flags, reg, cycles, ram = snapshot.unpack(data)
+
+        self.reg[:] = reg
+        self.pc = pc
+        self.fl = fl
+        self.ie = bool(flags & snapshot.IE)
+        self.halted = bool(flags & snapshot.HALTED)
+        self.cycles = cycles
+        self.running = False
+        self.idle = False
+        # look at IM/IS, and the events, before the first instruction
+        self.due = 0
+
+        # only throw away decoded instructions whose bytes are different, so
+        # restoring over the same program (the usual case) keeps the rest
+        if self.ram != ram:
+            self.rewrite(ram)
+
+    def rewrite(self, data):
+        """Replace all of RAM with `data`, invalidating whatever changed."""
+
+        ram = self.ram
+        code = self.code
+
+        # skip 16 bytes at a time where nothing changed
+        for start in range(0, 256, 16):
+            if ram[start:start + 16] == data[start:start + 16]:
+                continue
+
+            for address in range(start, start + 16):
+                if ram[address] != data[address]:
+                    ram[address] = data[address]
+
+                    if code >> address & 1:
+                        self.invalidate(address)
+
+    # Interrupts
+
+    def interrupt(self, number):
+        """Raise interrupt `number` (0-7), e.g. from a device."""
+
+        if self.recorder is not None:
+            self.recorder.interrupt(number)
+
+        self.reg[IS] |= 1 << number
+        self.due = 0
+
+    def key(self, value):
+        """A key was pressed: store it at KEY and raise interrupt 1."""
+
+        if self.recorder is not None:
+            self.recorder.key(value & 0xFF)
+
+        self.ram_write(value & 0xFF, KEY)
+
+        if self.debugger is not None:
+            self.debugger.check([(KEY, "write")])
+
+        self.interrupt(1)
+
+    def schedule(self, cycle, callback):
+        """Call `callback(cpu, cycle)` once `cycle` instructions have run."""
+
+        if self.events is NO_EVENTS:
+            self.events = EventQueue()
+
+        self.events.schedule(cycle, callback)
+
+        if cycle < self.due:
+            self.due = cycle
+
+    def service(self, cycles):
+        """
+        Run any events that are due, then dispatch the highest priority
+        pending interrupt, if interrupts are on.
+
+        Returns the cycle count at which the run loop should call this again.
+        If the CPU is idle, `cycles` may have been moved on (see skip_idle),
+        so loops that keep their own count should reload it from
+        `self.cycles`.
+        """
+
+        if self.idle:
+            cycles = self.skip_idle(cycles)
+
+        self.cycles = cycles
+        self.events.run(self, cycles)
+
+        if self.ie:
+            pending = self.reg[IM] & self.reg[IS]
+
+            if pending:
+                # lowest set bit wins
+                self.dispatch((pending & -pending).bit_length() - 1)
+
+        if cycles >= self.limit:
+            # end of the slice run() was asked for
+            self.running = False
+
+        return min(self.events.due(), self.limit)
+
+    def skip_idle(self, cycles):
+        """
+        Fast-forward an idle loop to the next event, or the end of the slice.
+
+        Going round `Loop: JMP R0` changes nothing but the cycle count, so
+        rather than spin we add on the instructions it would have run until
+        something can happen. Cycle-based timers still fire on the same
+        cycle they would have. Returns the new cycle count.
+        """
+
+        if self.ie and self.reg[IM] & self.reg[IS]:
+            # an interrupt is about to be taken, so it isn't idle after all
+            self.idle = False
+            return cycles
+
+        target = min(self.events.due(), self.limit)
+
+        if target == NEVER:
+            # nothing will ever wake it up; just keep spinning
+            return cycles
+
+        return max(cycles, target)
+
+    def dispatch(self, number):
+        """Enter the handler for interrupt `number`."""
+
+        self.idle = False
+        self.ie = False
+        self.reg[IS] &= ~(1 << number) & 0xFF
+
+        # PC, FL, then R0-R6; IRET pops them in the opposite order
+        self.push(self.pc)
+        self.push(self.fl)
+
+        for i in range(7):
+            self.push(self.reg[i])
+
+        if self.debugger is not None:
+            # the 9 bytes just pushed, for write watchpoints
+            sp = self.reg[SP]
+            self.debugger.check([((sp + i) & 0xFF, "write")
+                                 for i in range(9)])
+
+        self.pc = self.ram[VECTORS + number]
+
+    def push(self, value):
+        self.reg[SP] = (self.reg[SP] - 1) & 0xFF
+        self.ram_write(value, self.reg[SP])
 
     def alu(self, op, reg_a, reg_b):
         """ALU operations."""
 
-        if op == "ADD":
-            self.reg[reg_a] += self.reg[reg_b]
-        # elif op == "SUB": etc
-        else:
+        if op not in ("ADD", "SUB", "MUL", "DIV", "MOD", "INC", "DEC",
+                      "CMP", "AND", "OR", "XOR", "NOT", "SHL", "SHR"):
             raise Exception("Unsupported ALU operation")
 
+        getattr(self, "handle_" + op.lower())(reg_a, reg_b)
+
     def trace(self):
         """
         Handy function to print out the CPU state. You might want to call this
         from run() if you need help debugging.
         """
 
+        # For anything longer than a few instructions, use CPU(trace=...)
+        # instead, which records into a ring buffer (see tracer.py).
+
         print(f"TRACE: %02X | %02X %02X %02X |" % (
             self.pc,
             # self.fl,
             # self.ie,
             self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
+            self.ram_read((self.pc + 1) & 0xFF),
+            self.ram_read((self.pc + 2) & 0xFF)
         ), end='')
 
         for i in range(8):
@@ -118,112 +595,464 @@ class CPU:
 
         print()
 
-    def run(self):
-        """Run the CPU."""
+    # Instruction handlers
+    #
+    # Every handler takes the two bytes following the opcode, already fetched
+    # by `decode()`. Handlers that don't need them just ignore them.
+    #
+    # By the time a handler runs, `self.pc` already points at the next
+    # instruction, so handlers that jump simply overwrite it.
+    #
+    # A handler returns True if an interrupt may have become deliverable
+    # (INT, IRET), so the run loop knows to check before the next one.
+    #
+    # Registers and RAM are bytearrays, so every result is masked with 0xFF
+    # to wrap around at 8 bits the way the spec says.
+
+    def handle_unknown(self, command, address):
+        self.sink.write(f'Unknown instruction {command:08b} '
+                        f'at address {address:02X}\n')
+        self.sink.flush()
+        sys.exit(1)
+
+    def handle_nop(self, operand_a, operand_b):
+        pass
+
+    def handle_hlt(self, operand_a, operand_b):
+        self.running = False
+        self.halted = True
+        self.sink.flush()
+
+    def handle_ldi(self, operand_a, operand_b):
+        self.reg[operand_a] = operand_b
+
+    def handle_ld(self, operand_a, operand_b):
+        self.reg[operand_a] = self.ram_read(self.reg[operand_b])
+
+    def handle_st(self, operand_a, operand_b):
+        self.ram_write(self.reg[operand_b], self.reg[operand_a])
+
+    def handle_prn(self, operand_a, operand_b):
+        self.sink.write(f"{self.reg[operand_a]}\n")
+
+    def handle_pra(self, operand_a, operand_b):
+        self.sink.write(chr(self.reg[operand_a]))
+
+    # ALU
+
+    def handle_add(self, operand_a, operand_b):
+        reg = self.reg
+        reg[operand_a] = (reg[operand_a] + reg[operand_b]) & 0xFF
+
+    def handle_sub(self, operand_a, operand_b):
+        reg = self.reg
+        reg[operand_a] = (reg[operand_a] - reg[operand_b]) & 0xFF
+
+    def handle_mul(self, operand_a, operand_b):
+        reg = self.reg
+        reg[operand_a] = (reg[operand_a] * reg[operand_b]) & 0xFF
+
+    def handle_div(self, operand_a, operand_b):
+        if self.reg[operand_b] == 0:
+            self.sink.write('Error: division by zero\n')
+            self.running = False
+            self.halted = True
+            return
+
+        self.reg[operand_a] //= self.reg[operand_b]
+
+    def handle_mod(self, operand_a, operand_b):
+        if self.reg[operand_b] == 0:
+            self.sink.write('Error: division by zero\n')
+            self.running = False
+            self.halted = True
+            return
+
+        self.reg[operand_a] %= self.reg[operand_b]
+
+    def handle_inc(self, operand_a, operand_b):
+        self.reg[operand_a] = (self.reg[operand_a] + 1) & 0xFF
+
+    def handle_dec(self, operand_a, operand_b):
+        self.reg[operand_a] = (self.reg[operand_a] - 1) & 0xFF
+
+    def handle_cmp(self, operand_a, operand_b):
+        a = self.reg[operand_a]
+        b = self.reg[operand_b]
+
+        if a < b:
+            self.fl = 0b100  # L
+        elif a > b:
+            self.fl = 0b010  # G
+        else:
+            self.fl = 0b001  # E
+
+    def handle_and(self, operand_a, operand_b):
+        self.reg[operand_a] &= self.reg[operand_b]
+
+    def handle_or(self, operand_a, operand_b):
+        self.reg[operand_a] |= self.reg[operand_b]
+
+    def handle_xor(self, operand_a, operand_b):
+        self.reg[operand_a] ^= self.reg[operand_b]
+
+    def handle_not(self, operand_a, operand_b):
+        self.reg[operand_a] = ~self.reg[operand_a] & 0xFF
+
+    def handle_shl(self, operand_a, operand_b):
+        reg = self.reg
+        reg[operand_a] = (reg[operand_a] << reg[operand_b]) & 0xFF
+
+    def handle_shr(self, operand_a, operand_b):
+        self.reg[operand_a] >>= self.reg[operand_b]
+
+    # Stack
+
+    def handle_push(self, operand_a, operand_b):
+        self.reg[SP] = (self.reg[SP] - 1) & 0xFF
+        self.ram_write(self.reg[operand_a], self.reg[SP])
+
+    def handle_pop(self, operand_a, operand_b):
+        self.reg[operand_a] = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
+
+    # Instructions that set the PC directly
+
+    def handle_call(self, operand_a, operand_b):
+        # push the address of the instruction after CALL, then jump
+        self.reg[SP] = (self.reg[SP] - 1) & 0xFF
+        self.ram_write(self.pc, self.reg[SP])
+        self.pc = self.reg[operand_a]
 
-        running = True
+    def handle_ret(self, operand_a, operand_b):
+        self.pc = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
+
+    def handle_int(self, operand_a, operand_b):
+        # set the matching bit in IS (R6)
+        self.reg[6] |= 1 << (self.reg[operand_a] & 0b111)
+        self.due = 0
+        return True
+
+    def handle_iret(self, operand_a, operand_b):
+        # pop R6-R0, then FL, then the return address
+        for i in range(6, -1, -1):
+            self.reg[i] = self.ram_read(self.reg[SP])
+            self.reg[SP] = (self.reg[SP] + 1) & 0xFF
+
+        self.fl = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
+
+        self.pc = self.ram_read(self.reg[SP])
+        self.reg[SP] = (self.reg[SP] + 1) & 0xFF
+
+        self.ie = True
+        self.due = 0
+        return True
+
+    def handle_jmp(self, operand_a, operand_b):
+        target = self.reg[operand_a]
+
+        # self.pc is already past this 2-byte JMP: is it jumping to itself?
+        if target == (self.pc - 2) & 0xFF:
+            self.pc = target
+            return self.went_idle()
+
+        self.pc = target
+
+    def jump_if(self, condition, operand_a):
+        if condition:
+            # same as JMP; FL can't change while it spins, so a conditional
+            # jump to itself is just as stuck
+            return self.handle_jmp(operand_a, 0)
+
+    def went_idle(self):
+        """Flag an idle loop and get the run loop to call service()."""
+        self.idle = True
+        self.due = 0
+        return True
+
+    def handle_jeq(self, operand_a, operand_b):
+        return self.jump_if(self.fl & 0b001, operand_a)
+
+    def handle_jne(self, operand_a, operand_b):
+        return self.jump_if(not self.fl & 0b001, operand_a)
+
+    def handle_jgt(self, operand_a, operand_b):
+        return self.jump_if(self.fl & 0b010, operand_a)
+
+    def handle_jlt(self, operand_a, operand_b):
+        return self.jump_if(self.fl & 0b100, operand_a)
+
+    def handle_jge(self, operand_a, operand_b):
+        return self.jump_if(self.fl & 0b011, operand_a)
+
+    def handle_jle(self, operand_a, operand_b):
+        return self.jump_if(self.fl & 0b101, operand_a)
+
+    def run(self, max_cycles=None):
+        """
+        Run the CPU until it halts, or for `max_cycles` instructions.
+
+        A slice that ends early leaves the CPU ready to carry on with the
+        next run(); check `halted` to tell the two apart. (The blocks engine
+        only stops between blocks, so its slices can run a little over.)
+
+        Once the CPU has halted this does nothing; load a program or restore
+        a snapshot to start it again.
+        """
+
+        if self.halted:
+            return
+
+        if max_cycles is None:
+            self.limit = NEVER
+        else:
+            self.limit = self.cycles + max_cycles
+
+            if self.limit < self.due:
+                self.due = self.limit
+
+        self.loop(self)
+
+    def run_interpreter(self):
+        """Run the CPU one instruction at a time."""
+
+        self.running = True
         # self.pc = 0
 
-        while running:
-            command = self.ram[self.pc]
+        decoded = self.decoded
+        cycles = self.cycles
+        due = self.due
+
+        try:
+            while self.running:
+                if cycles >= due:
+                    due = self.service(cycles)
+                    # an idle loop may have been skipped ahead
+                    cycles = self.cycles
+
+                    if not self.running:
+                        break
+
+                entry = decoded.get(self.pc)
+
+                if entry is None:
+                    entry = self.decode(self.pc)
+
+                # advance the PC before executing; jumps overwrite it
+                handler, operand_a, operand_b, self.pc, weight = entry
 
-            # SAVE
-            if command == self.SAVE:
-                num_to_save = self.ram[self.pc + 1]
-                register_address = self.ram[self.pc + 2]
-                self.reg[num_to_save] = register_address
-                # self.pc += 2  # (command >> 6)
+                if handler(self, operand_a, operand_b):
+                    due = 0
 
-            # PRINT_REG
-            elif command == self.PRINT_REG:
-                reg_address = self.ram[self.pc + 1]
-                print(self.reg[reg_address])
-                # same
-                # print(self.reg[self.ram_read(self.pc + 1)])
-                # self.pc += (command >> 6)
+                cycles += weight
+        finally:
+            self.cycles = cycles
+            self.due = due
+            self.sink.flush()
 
-            elif command == self.ADD:
-                reg1_address = self.ram[self.pc + 1]
-                reg2_address = self.ram[self.pc + 2]
+    def run_blocks(self):
+        """Run the CPU a basic block at a time."""
 
-                self.reg[reg1_address] += self.reg[reg2_address]
+        self.running = True
 
-            # MULT
-            elif command == self.MULT:
-                reg1_address = self.ram[self.pc + 1]
-                reg2_address = self.ram[self.pc + 2]
+        blocks = self.blocks
 
-                # self.reg[reg1_address] = self.reg[reg1_address] * self.reg[reg2_address]
-                self.reg[reg1_address] *= self.reg[reg2_address]
+        try:
+            while self.running:
+                # events are checked between blocks, so they can be up to a
+                # block (MAX_BLOCK instructions) late
+                if self.cycles >= self.due:
+                    self.due = self.service(self.cycles)
+
+                    if not self.running:
+                        break
+
+                block = blocks.get(self.pc)
+
+                if block is None:
+                    block = self.translate(self.pc)
 
-            elif command == self.PUSH:
-                self.reg[7] -= 1
+                function = block[0]
 
-                register_address = self.ram[self.pc + 1]
-                value = self.reg[register_address]
+                if function is None:
+                    # nothing translatable here, so single-step it
+                    entry = self.decoded.get(self.pc) or self.decode(self.pc)
+                    handler, operand_a, operand_b, self.pc, weight = entry
 
-                SP = self.reg[7]
-                self.ram[SP] = value
+                    if handler(self, operand_a, operand_b):
+                        self.due = 0
 
-            elif command == self.POP:
-                SP = self.reg[7]
+                    self.cycles += weight
+                else:
+                    self.cycles += function(self, self.reg, self.ram,
+                                            self.code)
+        finally:
+            self.sink.flush()
 
-                value = self.ram[SP]
+    def run_traced(self):
+        """Run the CPU one instruction at a time, recording `self.tracer`."""
 
-                register_address = self.ram[self.pc + 1]
+        from tracer import RECORD
 
-                self.reg[register_address] = value
+        self.running = True
+
+        decoded = self.decoded
+        ram = self.ram
+        reg = self.reg
+        tracer = self.tracer
+        buffer = tracer.buffer
+        size = len(buffer)
+        position = tracer.position
+        count = tracer.count
+
+        try:
+            while self.running:
+                if self.cycles >= self.due:
+                    self.due = self.service(self.cycles)
 
-                self.reg[7] += 1
+                    if not self.running:
+                        break
 
-            elif command == self.CALL:
-                # 1. push return address into Stack
-                # find the address/index of the command AFTER call
-                next_command_address = self.pc + 2
+                pc = self.pc
+                entry = decoded.get(pc)
 
-                # push the address into Stack
-                # decrement the SP
-                self.reg[7] -= 1
+                if entry is None:
+                    entry = self.decode(pc)
+
+                # the record is the state just before the instruction runs
+                o = position
+                buffer[o] = pc
+                if pc < 0xFE:
+                    buffer[o + 1:o + 4] = ram[pc:pc + 3]
+                else:
+                    buffer[o + 1] = ram[pc]
+                    buffer[o + 2] = ram[(pc + 1) & 0xFF]
+                    buffer[o + 3] = ram[(pc + 2) & 0xFF]
+                buffer[o + 4:o + 12] = reg
+                buffer[o + 12] = self.fl
+
+                position += RECORD
+                if position == size:
+                    position = 0
+                count += 1
+
+                handler, operand_a, operand_b, self.pc, weight = entry
+
+                if handler(self, operand_a, operand_b):
+                    self.due = 0
+
+                self.cycles += weight
+        finally:
+            tracer.position = position
+            tracer.count = count
+
+            # HLT, a fault or an exception: whatever stopped us, the last
+            # instructions before it are what's worth keeping
+            if tracer.filename:
+                tracer.dump()
+
+            self.sink.flush()
+
+    def run_profiled(self):
+        """Run the CPU one instruction at a time, filling in `self.profile`."""
+
+        from profiler import CLASSES
+
+        self.running = True
+
+        decoded = self.decoded
+        profile = self.profile
+        opcodes = profile.opcodes
+        addresses = profile.addresses
+        class_time = profile.class_time
+        clock = time.perf_counter_ns
+
+        try:
+            while self.running:
+                if self.cycles >= self.due:
+                    self.due = self.service(self.cycles)
 
-                # put the next command address at the location in memory
-                # where the stack pointer points
-                SP = self.reg[7]
-                self.ram[SP] = next_command_address
+                    if not self.running:
+                        break
 
-                # 2. jump, set the PC to wherever the register says
-                # find the number of the register to look at
-                register_address = self.ram[self.pc + 1]
+                pc = self.pc
+                entry = decoded.get(pc)
 
-                # get the address of the subroutine out of that register
-                address_to_jump = self.reg[register_address]
+                if entry is None:
+                    entry = self.decode(pc)
 
-                # set the pc
-                self.pc = address_to_jump
+                command = self.ram[pc]
+                handler, operand_a, operand_b, self.pc, weight = entry
 
-            elif command == self.RET:
-                # Pop the value from the top of the stack and store it in the `PC`
+                start = clock()
+                if handler(self, operand_a, operand_b):
+                    self.due = 0
+                class_time[CLASSES[command]] += clock() - start
 
-                # Pop from top of stack
-                # get the value first
-                SP = self.reg[7]
-                return_address = self.ram[SP]
+                opcodes[command] += 1
+                addresses[pc] += 1
+                self.cycles += weight
+                profile.instructions += 1
 
-                # then move the stack pointer back up
-                self.reg[7] += 1
+                if command == CALL:
+                    profile.call(self.pc)
+                elif command == RET:
+                    profile.ret()
+        finally:
+            self.sink.flush()
 
-                # jump back, set PC to this value
-                self.pc = return_address
 
-            # HLT
-            elif command == self.HALT:
-                running = False
+def _checks_interrupts(handler):
+    """Wrap `handler` so the run loop checks for interrupts after it."""
 
-            number_of_operands = command >> 6
+    @functools.wraps(handler)
+    def handle(cpu, operand_a, operand_b):
+        handler(cpu, operand_a, operand_b)
+        cpu.due = 0
+        return True
 
-            # bit shift and mask to isolate the 'C' bit
-            sets_pc_directly = ((command >> 4) & 0b001) == 0b001
+    return handle
 
-            if not sets_pc_directly:
-                self.pc += (1 + number_of_operands)
 
-            # self.pc += 1
+# Branch table: one handler per possible opcode byte, so `run()` decodes with
+# a single list index instead of an if/elif chain. It lives on the class, so
+# it's shared by every CPU instead of being rebuilt for each one.
+table = [CPU.handle_unknown] * 256
+table[LDI] = CPU.handle_ldi
+table[PRN] = CPU.handle_prn
+table[HLT] = CPU.handle_hlt
+table[MUL] = CPU.handle_mul
+table[POP] = CPU.handle_pop
+table[PUSH] = CPU.handle_push
+table[ADD] = CPU.handle_add
+table[CALL] = CPU.handle_call
+table[JMP] = CPU.handle_jmp
+table[RET] = CPU.handle_ret
+table[AND] = CPU.handle_and
+table[CMP] = CPU.handle_cmp
+table[DEC] = CPU.handle_dec
+table[DIV] = CPU.handle_div
+table[INC] = CPU.handle_inc
+table[INT] = CPU.handle_int
+table[IRET] = CPU.handle_iret
+table[JEQ] = CPU.handle_jeq
+table[JGE] = CPU.handle_jge
+table[JGT] = CPU.handle_jgt
+table[JLE] = CPU.handle_jle
+table[JLT] = CPU.handle_jlt
+table[JNE] = CPU.handle_jne
+table[LD] = CPU.handle_ld
+table[MOD] = CPU.handle_mod
+table[NOP] = CPU.handle_nop
+table[NOT] = CPU.handle_not
+table[OR] = CPU.handle_or
+table[PRA] = CPU.handle_pra
+table[SHL] = CPU.handle_shl
+table[SHR] = CPU.handle_shr
+table[ST] = CPU.handle_st
+table[SUB] = CPU.handle_sub
+table[XOR] = CPU.handle_xor
+CPU.branchtable = table
+del table
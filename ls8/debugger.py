@@ -0,0 +1,287 @@
+"""Breakpoints, watchpoints and stepping for a CPU."""
+
+# Nothing here touches the run loops. Instead, while a Debugger is attached,
+# CPU.decode() hands every instruction it decodes to Debugger.patch(), which
+# can swap in a different handler for that one decoded entry:
+#
+# * an instruction with a breakpoint on it gets `_trap`, which stops the CPU
+#   before the instruction runs (or runs it, if a condition says not to stop)
+# * with watchpoints set, instructions that touch RAM (LD, ST, PUSH, POP,
+#   CALL, RET, IRET) get a wrapper that checks the addresses they use
+#
+# Every other instruction keeps its normal handler, so it runs at full speed
+# and a program with no breakpoints or watchpoints doesn't slow down at all.
+#
+#   dbg = Debugger(cpu)
+#   dbg.break_at(0x1A)
+#   dbg.break_at(0x20, lambda cpu: cpu.reg[0] == 3)
+#   dbg.watch(0xF0, 0xF4, read=True)
+#   dbg.cont()        # -> ("break", 0x1A)
+#   dbg.step()
+#   dbg.run_until(0x30)
+
+import functools
+
+from cpu import CPU, SP
+from events import NEVER
+
+
+class Break(Exception):
+    """Raised by a breakpoint trap to leave the run loop."""
+
+
+def _trap(cpu, address, original):
+    """Handler for an instruction with a breakpoint on it."""
+
+    debugger = cpu.debugger
+    condition = debugger.breakpoints[address]
+
+    if condition is not None and not condition(cpu):
+        # not stopping this time: run the real instruction instead
+        handler, operand_a, operand_b, cpu.pc, weight = original
+        return handler(cpu, operand_a, operand_b)
+
+    # the loop already moved the PC on; put it back on the breakpoint
+    cpu.pc = address
+    debugger.stop = ("break", address)
+
+    # raising (instead of clearing `running`) leaves the loop before it
+    # counts this instruction as executed
+    raise Break(address)
+
+
+# Opcode handler -> function giving the RAM addresses it's about to touch,
+# as (address, "read" or "write") pairs
+ACCESSES = {
+    CPU.handle_ld: lambda reg, a, b: [(reg[b], "read")],
+    CPU.handle_st: lambda reg, a, b: [(reg[a], "write")],
+    CPU.handle_push: lambda reg, a, b: [((reg[SP] - 1) & 0xFF, "write")],
+    CPU.handle_pop: lambda reg, a, b: [(reg[SP], "read")],
+    CPU.handle_call: lambda reg, a, b: [((reg[SP] - 1) & 0xFF, "write")],
+    CPU.handle_ret: lambda reg, a, b: [(reg[SP], "read")],
+    # R6-R0, FL and the return address
+    CPU.handle_iret: lambda reg, a, b: [
+        ((reg[SP] + i) & 0xFF, "read") for i in range(9)
+    ],
+}
+
+
+def _watched(handler, accesses):
+    """Wrap a RAM-touching handler so it checks the watchpoints."""
+
+    @functools.wraps(handler)
+    def handle(cpu, operand_a, operand_b):
+        used = accesses(cpu.reg, operand_a, operand_b)
+        result = handler(cpu, operand_a, operand_b)
+        cpu.debugger.check(used)
+        return result
+
+    return handle
+
+
+class Debugger:
+    """Attach to `cpu` and control how it runs."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+        # address -> condition (a function of the CPU), or None to always stop
+        self.breakpoints = {}
+        # addresses being watched for reads and for writes
+        self.reads = set()
+        self.writes = set()
+
+        # why the CPU last stopped, e.g. ("break", 0x1A)
+        self.stop = None
+        # a watchpoint hit while the CPU wasn't running (a key press
+        # between runs, say), for the next step() or cont() to report
+        self.pending = None
+
+        # breakpoints live in decoded entries, which translated blocks skip
+        self.loop = cpu.loop
+        if cpu.loop is CPU.run_blocks:
+            cpu.loop = CPU.run_interpreter
+
+        # and stepping has to go one real instruction at a time
+        self.fuse = cpu.fuse
+        cpu.fuse = False
+
+        cpu.debugger = self
+        cpu.decoded.clear()
+
+    def detach(self):
+        """Put the CPU back the way it was, minus any breakpoints."""
+
+        cpu = self.cpu
+        cpu.debugger = None
+        cpu.loop = self.loop
+        cpu.fuse = self.fuse
+        cpu.flush()
+
+    def patch(self, address, entry):
+        """Called by CPU.decode(): the entry to cache for `address`."""
+
+        handler = entry[0]
+        # look through CPU.decode()'s own wrapper, if it added one
+        accesses = ACCESSES.get(getattr(handler, "__wrapped__", handler))
+
+        if (self.reads or self.writes) and accesses is not None:
+            entry = (_watched(handler, accesses),) + entry[1:]
+
+        if address in self.breakpoints:
+            # keep next_pc, so writes over the instruction still invalidate it
+            entry = (_trap, address, entry, entry[3], 1)
+
+        return entry
+
+    def check(self, used):
+        """Stop the CPU if any of the `used` addresses are watched."""
+
+        for address, kind in used:
+            watched = self.reads if kind == "read" else self.writes
+
+            if address in watched:
+                # unlike a breakpoint, the instruction has already run
+                self.stop = ("watch", address, kind)
+
+                if not self.cpu.running:
+                    self.pending = self.stop
+
+                self.cpu.running = False
+                return
+
+    # Breakpoints and watchpoints
+
+    def break_at(self, address, condition=None):
+        """
+        Stop before the instruction at `address` runs.
+
+        With `condition` (a function taking the CPU), only stop when it
+        returns true.
+        """
+        self.breakpoints[address] = condition
+        self.cpu.decoded.pop(address, None)
+
+    def clear(self, address):
+        """Remove the breakpoint at `address`."""
+        self.breakpoints.pop(address, None)
+        self.cpu.decoded.pop(address, None)
+
+    def watch(self, start, end=None, read=False, write=True):
+        """
+        Stop after any instruction that reads or writes RAM in
+        `start`..`end` (inclusive; just `start` if `end` is left out).
+        """
+
+        addresses = range(start, (start if end is None else end) + 1)
+
+        if read:
+            self.reads.update(addresses)
+        if write:
+            self.writes.update(addresses)
+
+        # every RAM-touching instruction needs re-patching
+        self.cpu.decoded.clear()
+
+    def unwatch(self, start, end=None):
+        """Remove read and write watchpoints from `start`..`end`."""
+
+        addresses = range(start, (start if end is None else end) + 1)
+        self.reads.difference_update(addresses)
+        self.writes.difference_update(addresses)
+        self.cpu.decoded.clear()
+
+    # Running
+
+    def step(self, count=1):
+        """
+        Run `count` instructions, ignoring breakpoints (but not
+        watchpoints). Returns the stop reason.
+        """
+
+        cpu = self.cpu
+        # a watchpoint hit since the last run gets reported first
+        self.stop, self.pending = self.pending, None
+
+        if cpu.halted or self.stop is not None:
+            return self.result()
+
+        cpu.running = True
+        # a slice left over from an earlier cpu.run(max_cycles) would make
+        # service() stop us
+        cpu.limit = NEVER
+
+        for _ in range(count):
+            if cpu.cycles >= cpu.due:
+                cpu.due = cpu.service(cpu.cycles)
+
+                # entering an interrupt handler can hit a watchpoint
+                if not cpu.running:
+                    break
+
+            entry = cpu.decoded.get(cpu.pc) or cpu.decode(cpu.pc)
+
+            if entry[0] is _trap:
+                entry = entry[2]
+
+            handler, operand_a, operand_b, cpu.pc, weight = entry
+
+            if handler(cpu, operand_a, operand_b):
+                cpu.due = 0
+
+            cpu.cycles += weight
+
+            if not cpu.running:
+                break
+
+        cpu.sink.flush()
+
+        return self.result()
+
+    def cont(self):
+        """Run until a breakpoint, a watchpoint or HLT. Returns the reason."""
+
+        cpu = self.cpu
+        self.stop, self.pending = self.pending, None
+
+        if cpu.halted or self.stop is not None:
+            return self.result()
+
+        # if we're sitting on a breakpoint, get past it first
+        if cpu.pc in self.breakpoints:
+            self.step()
+
+            if self.stop is not None or cpu.halted:
+                return self.result()
+
+        self.stop = None
+
+        try:
+            cpu.run()
+        except Break:
+            pass
+
+        return self.result()
+
+    def run_until(self, address):
+        """Run until the PC reaches `address` (or something else stops it)."""
+
+        if address in self.breakpoints:
+            return self.cont()
+
+        self.break_at(address)
+
+        try:
+            return self.cont()
+        finally:
+            self.clear(address)
+
+    def result(self):
+        """Why the CPU stopped: a breakpoint, a watchpoint or a halt."""
+
+        if self.stop is not None:
+            return self.stop
+        if self.cpu.halted:
+            return ("halt", self.cpu.pc)
+
+        return ("step", self.cpu.pc)
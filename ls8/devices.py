@@ -0,0 +1,206 @@
+"""Keyboard and console devices on asyncio."""
+
+# Checking stdin for a key on every instruction would cost far more than
+# the instruction itself. Instead the CPU runs in slices, as a coroutine
+# (VM.run) that hands control back to the asyncio event loop between them,
+# and the devices are tasks on that same loop:
+#
+# * Keyboard reads bytes from a StreamReader and, for each one, stores it
+#   at 0xF4 and raises I1 (CPU.key)
+# * Console is a sink (see sinks.py) whose output a task writes to a
+#   StreamWriter, waiting on drain() so a slow reader holds the VM back
+#   instead of buffering without limit
+#
+# Any number of VMs can share one event loop, each with its own streams:
+#
+#   await asyncio.gather(VM(cpu1, reader1, writer1).run(),
+#                        VM(cpu2, reader2, writer2).run())
+#
+# run_stdio() hooks a single CPU up to the terminal, for ls8.py.
+#
+# A program waiting in an idle loop (`Loop: JMP R0`) gets its slices over
+# with almost at once (see CPU.skip_idle), and then the VM sleeps until a
+# key arrives or IDLE_SLEEP is up, instead of spinning.
+
+import asyncio
+import os
+import stat
+import sys
+import termios
+import tty
+
+from cpu import IS
+
+# Instructions per slice: long enough that switching tasks is cheap next to
+# the work done, short enough that key presses are picked up promptly
+SLICE = 10000
+
+# Longest an idle VM sleeps before running again, in seconds. Wall-clock
+# timers (events.Timer) are only checked when it runs, so this is how late
+# they can be.
+IDLE_SLEEP = 0.01
+
+
+class Keyboard:
+    """Feeds bytes from `reader` to `cpu` as key presses."""
+
+    def __init__(self, cpu, reader, wakeup=None):
+        """`wakeup`, an asyncio.Event, is set after each key."""
+        self.cpu = cpu
+        self.reader = reader
+        self.wakeup = wakeup
+        # set by the VM after each slice it runs
+        self.ran = asyncio.Event()
+
+    async def run(self):
+        cpu = self.cpu
+
+        while True:
+            data = await self.reader.read(1)
+
+            if not data:
+                return
+
+            # a real keyboard would just overwrite 0xF4; here we can wait
+            # until the previous key's interrupt has been taken, so pasted
+            # or piped input doesn't lose characters. Nothing can take it
+            # but the CPU, so only look again after it has had a slice.
+            while cpu.reg[IS] & 0b10 and not cpu.halted:
+                self.ran.clear()
+                await self.ran.wait()
+
+            cpu.key(data[0])
+
+            if self.wakeup is not None:
+                self.wakeup.set()
+
+
+class Console:
+    """Sink that sends PRN/PRA output to an asyncio StreamWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.buffer = []
+        self.queue = asyncio.Queue()
+
+    def write(self, text):
+        self.buffer.append(text)
+
+    def flush(self):
+        # called from inside the (synchronous) run loop, so just hand the
+        # text over to the task
+        if self.buffer:
+            self.queue.put_nowait("".join(self.buffer))
+            self.buffer.clear()
+
+    async def run(self):
+        while True:
+            text = await self.queue.get()
+            self.writer.write(text.encode("latin-1"))
+            await self.writer.drain()
+            self.queue.task_done()
+
+
+class VM:
+    """A CPU plus its devices, run as a coroutine."""
+
+    def __init__(self, cpu, reader=None, writer=None, slice=SLICE):
+        """
+        `reader` (an asyncio.StreamReader) is the keyboard; `writer` (an
+        asyncio.StreamWriter) gets the output. Without a writer, output goes
+        to whatever sink the CPU already has.
+        """
+        self.cpu = cpu
+        self.slice = slice
+        self.wakeup = asyncio.Event()
+        self.keyboard = None
+        self.console = None
+
+        if reader is not None:
+            self.keyboard = Keyboard(cpu, reader, self.wakeup)
+
+        if writer is not None:
+            self.console = Console(writer)
+            cpu.sink = self.console
+
+    async def sleep(self):
+        """Wait for a key, or IDLE_SLEEP, whichever comes first."""
+
+        self.wakeup.clear()
+
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), IDLE_SLEEP)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """Run the CPU until it halts."""
+
+        cpu = self.cpu
+        tasks = []
+
+        if self.keyboard is not None:
+            tasks.append(asyncio.create_task(self.keyboard.run()))
+        if self.console is not None:
+            tasks.append(asyncio.create_task(self.console.run()))
+
+        try:
+            while not cpu.halted:
+                cpu.run(self.slice)
+
+                if self.keyboard is not None:
+                    self.keyboard.ran.set()
+
+                if cpu.idle and not cpu.halted:
+                    await self.sleep()
+                else:
+                    # let the devices (and any other VMs) have a turn
+                    await asyncio.sleep(0)
+
+            if self.console is not None:
+                await self.console.queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def open_reader(file):
+    """A StreamReader for `file` (a binary or text file object)."""
+
+    reader = asyncio.StreamReader()
+    mode = os.fstat(file.fileno()).st_mode
+
+    if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or file.isatty():
+        loop = asyncio.get_running_loop()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), file)
+    else:
+        # asyncio can't wait on regular files (or /dev/null), but those
+        # never block anyway, so just hand over everything in them
+        reader.feed_data(os.read(file.fileno(), 1 << 20))
+        reader.feed_eof()
+
+    return reader
+
+
+def run_stdio(cpu, slice=SLICE):
+    """Run `cpu` with stdin as its keyboard, one key at a time."""
+
+    async def main():
+        await VM(cpu, await open_reader(sys.stdin), slice=slice).run()
+
+    if not sys.stdin.isatty():
+        asyncio.run(main())
+        return
+
+    # deliver keys as they're typed instead of a line at a time
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+
+    try:
+        tty.setcbreak(fd)
+        asyncio.run(main())
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
@@ -0,0 +1,100 @@
+"""Cycle-based event scheduling and the interrupt sources."""
+
+# Things that happen "outside" the program (a timer tick, a key press, ...)
+# are events: callbacks scheduled to run once the CPU has executed a given
+# number of instructions. They're kept in a heap ordered by that cycle
+# count, so the run loop only compares its cycle counter against the
+# earliest one and never looks at the wall clock itself.
+#
+# A callback is called as `callback(cpu, cycle)`, between instructions. It
+# can post interrupts with cpu.interrupt() and schedule more events.
+
+import heapq
+import time
+
+# "No event due", as a cycle count every real one is below
+NEVER = float("inf")
+
+
+class EventQueue:
+    """Pending events, earliest first."""
+
+    def __init__(self):
+        self.heap = []
+        # tie-breaker, so events due on the same cycle run in the order they
+        # were scheduled (and callbacks never get compared)
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, cycle, callback):
+        heapq.heappush(self.heap, (cycle, self.sequence, callback))
+        self.sequence += 1
+
+    def due(self):
+        """Cycle count of the earliest event, or NEVER."""
+        return self.heap[0][0] if self.heap else NEVER
+
+    def run(self, cpu, cycle):
+        """Run every event due at or before `cycle`."""
+
+        heap = self.heap
+
+        while heap and heap[0][0] <= cycle:
+            _, _, callback = heapq.heappop(heap)
+            callback(cpu, cycle)
+
+    def clear(self):
+        self.heap.clear()
+
+
+class Timer:
+    """
+    Interrupt I0 source.
+
+    By default it fires once a second of wall time, as the spec says. The
+    clock is only read every `poll` instructions, from an event, so the run
+    loop itself never touches it.
+
+    With `cycles`, it fires every `cycles` instructions instead, which
+    doesn't depend on how fast the host is.
+    """
+
+    def __init__(self, seconds=1.0, cycles=None, poll=10000):
+        self.seconds = seconds
+        self.cycles = cycles
+        self.poll = poll
+        self.deadline = None
+
+    def start(self, cpu):
+        if self.cycles is None:
+            self.deadline = time.monotonic() + self.seconds
+            cpu.schedule(cpu.cycles + self.poll, self.check)
+        else:
+            cpu.schedule(cpu.cycles + self.cycles, self.tick)
+
+    def check(self, cpu, cycle):
+        now = time.monotonic()
+
+        if now >= self.deadline:
+            self.deadline += self.seconds
+
+            # don't queue up a burst of ticks after a long pause
+            if self.deadline < now:
+                self.deadline = now + self.seconds
+
+            self.fire(cpu)
+
+        cpu.schedule(cycle + self.poll, self.check)
+
+    def tick(self, cpu, cycle):
+        self.fire(cpu)
+        cpu.schedule(cycle + self.cycles, self.tick)
+
+    def fire(self, cpu):
+        cpu.interrupt(0)
+
+        # programs driven by the timer usually never HLT, so this is also
+        # when their buffered output gets shown
+        cpu.sink.flush()
@@ -0,0 +1,112 @@
+"""Copy-on-write forking: many CPUs started from one shared base."""
+
+# Loading a program into a new CPU means reading it, copying it into RAM
+# and then decoding (and fusing, or translating) it all over again in every
+# CPU that runs it. A Base is taken once from a CPU that's already loaded
+# and warmed up:
+#
+#   base = Base(cpu)
+#   children = [base.fork() for i in range(10000)]
+#
+# and holds a read-only copy of its RAM, its state and its decoded
+# instructions and blocks. Each fork starts in that state, with nothing
+# decoded of its own. The first time a fork needs the instruction (or block)
+# at an address, it takes the base's, as long as the bytes it was decoded
+# from are still the same in the fork's RAM; only code the fork has written
+# over gets decoded again. So the decoded code is shared by every fork, and
+# what each one keeps to itself grows with how far it has wandered from the
+# base.
+#
+# RAM itself is copied whole when forking: at 256 bytes that's a single
+# memcpy, cheaper than any page table would be to go through on every
+# access. dirty_pages() compares it to the base a PAGE at a time, to find
+# what a fork has changed.
+
+from cpu import CPU
+
+# Bytes per page for dirty_pages()
+PAGE = 16
+
+
+def changed_pages(old, new):
+    """Numbers of the PAGE-sized pages that differ between `old` and `new`."""
+
+    return [start // PAGE for start in range(0, len(new), PAGE)
+            if old[start:start + PAGE] != new[start:start + PAGE]]
+
+
+class Base:
+    """The frozen state of a CPU, for forking copies of it."""
+
+    __slots__ = ("ram", "state", "decoded", "blocks", "fusions", "engine",
+                 "fuse")
+
+    def __init__(self, cpu):
+        self.ram = bytes(cpu.ram)
+        self.state = cpu.snapshot()
+        self.engine = cpu.engine
+        self.fuse = cpu.fuse
+        self.fusions = dict(cpu.fusions)
+
+        if cpu.debugger is None:
+            self.decoded = dict(cpu.decoded)
+        else:
+            # these have breakpoints patched into them
+            self.decoded = {}
+
+        self.blocks = dict(cpu.blocks)
+
+    def fork(self, sink=None):
+        """
+        A new CPU in the base's state.
+
+        It shares nothing with the CPU the base was taken from but `sink`,
+        if given (otherwise it gets the usual stdout sink). Scheduled events
+        aren't copied.
+        """
+
+        cpu = CPU(self.engine, sink, fuse=self.fuse)
+
+        # RAM first, so restore() sees the program is already there and
+        # has nothing to invalidate
+        cpu.ram[:] = self.ram
+        cpu.restore(self.state)
+        cpu.fusions = dict(self.fusions)
+        cpu.base = self
+
+        return cpu
+
+    def entry(self, ram, address):
+        """The decoded entry at `address`, if it's still good for `ram`."""
+
+        entry = self.decoded.get(address)
+
+        if entry is None:
+            return None
+
+        end = entry[3]
+
+        # one that wraps round the end of RAM isn't worth the bother
+        if end <= address or ram[address:end] != self.ram[address:end]:
+            return None
+
+        return entry
+
+    def block(self, ram, address):
+        """The translated block at `address`, if it's still good for `ram`."""
+
+        block = self.blocks.get(address)
+
+        if block is None:
+            return None
+
+        end = block[1]
+
+        if ram[address:end] != self.ram[address:end]:
+            return None
+
+        return block
+
+    def dirty_pages(self, cpu):
+        """Pages of `cpu`'s RAM that no longer match the base."""
+        return changed_pages(self.ram, cpu.ram)
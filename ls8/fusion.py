@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""Superinstructions: common instruction sequences fused into one handler."""
+
+# Most of the time spent running a short instruction isn't the instruction,
+# it's the trip around the run loop to get to it. A few sequences show up
+# all over the example programs:
+#
+#   LDI Rx,addr + JMP Rx        LDI Rx,addr + CALL Rx
+#   CMP Ra,Rb + JEQ/JNE/... Rc
+#   POP Rb + POP Ra ...
+#
+# The first time CPU.decode() is asked for an address, it calls match() to
+# see if one of these starts there, and if so caches a single entry whose
+# handler does the work of the whole sequence. The result is exactly what
+# running them one at a time would leave behind; the entry's weight makes
+# `cycles` count every instruction in it.
+#
+# Only the first instruction's address gets the fused entry. Jumping into
+# the middle of a sequence just decodes that instruction normally. Writes
+# over any byte of a sequence invalidate it like any other instruction.
+#
+# Runs of PUSHes aren't fused: with the stack grown down into the code, one
+# push can overwrite the next PUSH, which the fused entry would already
+# have read. Nothing else fused here writes to RAM before its last
+# instruction.
+#
+# Usage: fusion.py program.ls8
+
+import sys
+
+from cpu import (
+    CALL, CMP, CPU, IM, IS, JEQ, JGE, JGT, JLE, JLT, JMP, JNE, LDI, POP, SP,
+)
+
+# Longest run of POPs fused into one entry
+MAX_RUN = 4
+
+
+def _ldi_jmp(cpu, operand_a, operand_b):
+    cpu.reg[operand_a] = operand_b
+
+    # `Loop: LDI R0,Loop; JMP R0` only ever stores the same value again
+    if operand_b == (cpu.pc - 5) & 0xFF:
+        cpu.pc = operand_b
+        return cpu.went_idle()
+
+    cpu.pc = operand_b
+
+
+def _ldi_call(cpu, operand_a, operand_b):
+    cpu.reg[operand_a] = operand_b
+
+    # same as handle_call: the return address is the PC after the CALL
+    cpu.reg[SP] = (cpu.reg[SP] - 1) & 0xFF
+    cpu.ram_write(cpu.pc, cpu.reg[SP])
+    cpu.pc = operand_b
+
+
+def _cmp_jump(mask, jump_if_clear=False):
+    """
+    Handler for CMP followed by a conditional jump on the FL bits in `mask`.
+
+    operand_b carries both CMP's second register (low 3 bits) and the
+    jump's register (the next 3).
+    """
+
+    def handle(cpu, operand_a, operand_b):
+        reg = cpu.reg
+        x = reg[operand_a]
+        y = reg[operand_b & 0b111]
+        fl = cpu.fl = 0b100 if x < y else 0b010 if x > y else 0b001
+
+        if bool(fl & mask) != jump_if_clear:
+            cpu.pc = reg[operand_b >> 3]
+
+    return handle
+
+
+def _pops(cpu, registers, operand_b):
+    for register in registers:
+        CPU.handle_pop(cpu, register, 0)
+
+
+# Conditional jump opcode -> (name, fused CMP handler)
+CMP_JUMPS = {
+    JEQ: ("CMP+JEQ", _cmp_jump(0b001)),
+    JNE: ("CMP+JNE", _cmp_jump(0b001, jump_if_clear=True)),
+    JGT: ("CMP+JGT", _cmp_jump(0b010)),
+    JLT: ("CMP+JLT", _cmp_jump(0b100)),
+    JGE: ("CMP+JGE", _cmp_jump(0b011)),
+    JLE: ("CMP+JLE", _cmp_jump(0b101)),
+}
+
+
+def match(ram, address):
+    """
+    Look for a fusable sequence at `address`.
+
+    Returns (name, entry) with a decoded entry for the whole sequence, or
+    None.
+    """
+
+    command = ram[address]
+    a = ram[(address + 1) & 0xFF] & 0b111
+    b = ram[(address + 2) & 0xFF]
+
+    if command == LDI:
+        second = ram[(address + 3) & 0xFF]
+        register = ram[(address + 4) & 0xFF] & 0b111
+
+        # writes to IM/IS need their own interrupt check, so leave them be
+        if register == a and a not in (IM, IS):
+            if second == JMP:
+                return "LDI+JMP", (_ldi_jmp, a, b, (address + 5) & 0xFF, 2)
+            if second == CALL:
+                return "LDI+CALL", (_ldi_call, a, b, (address + 5) & 0xFF, 2)
+
+    elif command == CMP:
+        second = ram[(address + 3) & 0xFF]
+
+        if second in CMP_JUMPS:
+            name, handler = CMP_JUMPS[second]
+            c = ram[(address + 4) & 0xFF] & 0b111
+            operands = (b & 0b111) | c << 3
+            return name, (handler, a, operands, (address + 5) & 0xFF, 2)
+
+    elif command == POP:
+        registers = []
+        next_pc = address
+
+        while len(registers) < MAX_RUN and ram[next_pc] == POP:
+            register = ram[(next_pc + 1) & 0xFF] & 0b111
+
+            if register in (IM, IS):
+                break
+
+            registers.append(register)
+            next_pc = (next_pc + 2) & 0xFF
+
+        if len(registers) > 1:
+            return "POP*", (_pops, tuple(registers), 0, next_pc,
+                            len(registers))
+
+    return None
+
+
+def scan(ram, start=0, end=256):
+    """
+    Sweep `start`..`end` of `ram` for sequences decode() would fuse.
+
+    Only reports: returns a dict of how many of each kind start there,
+    taking the instructions in order from `start`. (Where the PC really
+    goes decides which ones a running CPU fuses.)
+    """
+
+    counts = {}
+    address = start
+
+    while address < end:
+        found = match(ram, address)
+        size = 1 + (ram[address] >> 6)
+
+        if found is not None:
+            name, entry = found
+            next_pc = entry[3]
+
+            if next_pc <= address:
+                # ran off the end of RAM; decode() doesn't fuse those
+                break
+
+            counts[name] = counts.get(name, 0) + 1
+            address = next_pc
+        else:
+            address += size
+
+    return counts
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: fusion.py program.ls8", file=sys.stderr)
+        return 1
+
+    cpu = CPU()
+    cpu.load_file(argv[1])
+    counts = scan(cpu.ram)
+
+    for name, count in sorted(counts.items()):
+        print(f"{name:<10} {count}")
+
+    print(f"{sum(counts.values())} fusions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
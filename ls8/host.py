@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""Cooperative scheduler: many CPUs sharing one Python thread."""
+
+# CPU.run(max_cycles) runs a slice and returns, leaving the CPU ready to
+# carry on (see cpu.py). A Host keeps a list of guests and goes round it,
+# giving each a slice of `slice * priority` instructions per round, so a
+# priority 2 guest gets twice the instructions of a priority 1 guest and
+# every guest waits at most one round for its next turn.
+#
+# Guests that can't do anything are taken out of the round (parked):
+#
+# * halted ones, by HLT or a fault (an unknown instruction), for good
+# * ones sitting in an idle loop (see CPU.skip_idle) with no events
+#   scheduled, which only an interrupt from outside can wake. Raise those
+#   with Host.interrupt() or Host.key(), which puts the guest back in.
+#
+# Idle guests that do have events (a timer, say) stay in, but skip_idle
+# makes each of their turns cost next to nothing.
+#
+#   host = Host()
+#   for cpu in cpus:
+#       host.add(cpu)
+#   host.run()
+#
+# devices.VM does the same for a CPU driven by asyncio streams; a Host is
+# for packing in as many CPUs as possible.
+#
+# Usage: host.py program.ls8 [copies] [slice]
+
+import sys
+import time
+
+from devices import SLICE
+from sinks import NullSink
+
+
+class Guest:
+    """A CPU on a Host, and how it's getting on."""
+
+    __slots__ = ("cpu", "priority", "name", "parked", "fault", "turns")
+
+    def __init__(self, cpu, priority, name):
+        self.cpu = cpu
+        self.priority = priority
+        self.name = name
+        self.parked = False
+        self.fault = None  # exit status, if it died on a bad instruction
+        self.turns = 0
+
+
+class Host:
+    """Round-robin scheduler for any number of CPUs."""
+
+    def __init__(self, slice=SLICE):
+        self.slice = slice
+        self.guests = []  # the ones in the round
+        self.parked = []
+
+    def __len__(self):
+        return len(self.guests) + len(self.parked)
+
+    def add(self, cpu, priority=1, name=None):
+        """Put `cpu` in the round. Returns its Guest."""
+
+        if priority < 1:
+            raise ValueError(f"priority must be at least 1, not {priority}")
+
+        guest = Guest(cpu, priority, name)
+        self.guests.append(guest)
+
+        return guest
+
+    def remove(self, guest):
+        if guest.parked:
+            self.parked.remove(guest)
+        else:
+            self.guests.remove(guest)
+
+    def wake(self, guest):
+        """Put a parked guest back in the round (unless it's halted)."""
+
+        if guest.parked and not guest.cpu.halted:
+            self.parked.remove(guest)
+            guest.parked = False
+            self.guests.append(guest)
+
+    def interrupt(self, guest, number):
+        """Raise interrupt `number` on `guest`, waking it if need be."""
+        guest.cpu.interrupt(number)
+        self.wake(guest)
+
+    def key(self, guest, value):
+        """A key press for `guest`, waking it if need be."""
+        guest.cpu.key(value)
+        self.wake(guest)
+
+    def step(self):
+        """
+        Give every guest in the round one turn.
+
+        Returns how many guests are left in it.
+        """
+
+        slice = self.slice
+        running = []
+
+        for guest in self.guests:
+            cpu = guest.cpu
+
+            try:
+                cpu.run(slice * guest.priority)
+            except SystemExit as e:
+                # handle_unknown exits, which is right for ls8.py but
+                # shouldn't take the other guests with it
+                cpu.halted = True
+                guest.fault = e.code
+
+            guest.turns += 1
+
+            if cpu.halted or (cpu.idle and not cpu.events):
+                guest.parked = True
+                self.parked.append(guest)
+            else:
+                running.append(guest)
+
+        self.guests = running
+
+        return len(running)
+
+    def run(self, rounds=None):
+        """
+        Go round until every guest is parked, or for `rounds` rounds.
+
+        Returns the number of rounds run.
+        """
+
+        count = 0
+
+        while self.guests and (rounds is None or count < rounds):
+            self.step()
+            count += 1
+
+        return count
+
+
+def main(argv):
+    if len(argv) not in (2, 3, 4):
+        print("usage: host.py program.ls8 [copies] [slice]", file=sys.stderr)
+        return 1
+
+    from cpu import CPU
+    from fork import Base
+
+    copies = int(argv[2]) if len(argv) > 2 else 1000
+    slice = int(argv[3]) if len(argv) > 3 else SLICE
+
+    cpu = CPU(sink=NullSink())
+    cpu.load_file(argv[1])
+    base = Base(cpu)
+
+    host = Host(slice)
+
+    start = time.perf_counter()
+
+    for i in range(copies):
+        host.add(base.fork(NullSink()), name=i)
+
+    forked = time.perf_counter() - start
+    rounds = host.run()
+    elapsed = time.perf_counter() - start
+
+    guests = host.parked
+    # idle loops skipped over count too, so this can be far more than
+    # were really executed
+    cycles = sum(guest.cpu.cycles for guest in guests)
+    halted = sum(guest.cpu.halted for guest in guests)
+
+    print(f"{copies} guests forked in {forked * 1000:.1f} ms")
+    print(f"{rounds} rounds, {halted} halted, {len(guests) - halted} idle, "
+          f"{cycles} cycles in {elapsed:.3f} s "
+          f"({cycles / elapsed:,.0f} per second)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""Binary LS-8 program images."""
+
+# A text `.ls8` file has to be split, stripped and run through int(x, 2) one
+# line at a time before anything can run. An image is the same program as
+# raw bytes behind a small header, so loading it is a single readinto() into
+# RAM with no parsing at all.
+#
+# Layout (little-endian):
+#
+#   offset  size  field
+#   0       4     magic, b"LS8\0"
+#   4       1     format version
+#   5       1     entry point (initial PC)
+#   6       2     number of program bytes that follow
+#   8       ...   program bytes, loaded at address 0
+#
+# Usage: image.py infile.ls8 [outfile.ls8b]
+
+import struct
+import sys
+
+MAGIC = b"LS8\0"
+VERSION = 1
+HEADER = struct.Struct("<4sBBH")
+
+
+def parse_ls8(lines):
+    """Turn the lines of a text `.ls8` program into bytes."""
+
+    program = bytearray()
+
+    for line in lines:
+        split_line = line.split("#")[0]
+        stripped_split_line = split_line.strip()
+
+        if stripped_split_line != "":
+            program.append(int(stripped_split_line, 2))
+
+    return program
+
+
+def write_image(filename, program, entry=0):
+    """Write `program` bytes out as an image."""
+
+    if len(program) > 256:
+        raise ValueError(f"program is {len(program)} bytes, RAM is 256")
+
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, entry, len(program)))
+        f.write(program)
+
+
+def read_image(filename, ram):
+    """
+    Load the image in `filename` into `ram` (a bytearray) at address 0.
+
+    Returns the entry point.
+    """
+
+    with open(filename, "rb") as f:
+        header = f.read(HEADER.size)
+
+        if len(header) < HEADER.size:
+            raise ValueError(f"{filename}: truncated image header")
+
+        magic, version, entry, size = HEADER.unpack(header)
+
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not an LS-8 image")
+        if version != VERSION:
+            raise ValueError(
+                f"{filename}: unsupported image version {version}")
+        if size > len(ram):
+            raise ValueError(f"{filename}: {size} bytes won't fit in RAM")
+
+        if f.readinto(memoryview(ram)[:size]) != size:
+            raise ValueError(f"{filename} is truncated")
+
+    return entry
+
+
+def unpack_image(data):
+    """Split image bytes into (program, entry)."""
+
+    if len(data) < HEADER.size:
+        raise ValueError("truncated image header")
+
+    magic, version, entry, size = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError("not an LS-8 image")
+    if version != VERSION:
+        raise ValueError(f"unsupported image version {version}")
+
+    program = bytes(data[HEADER.size:HEADER.size + size])
+
+    if len(program) != size:
+        raise ValueError("image is truncated")
+
+    return program, entry
+
+
+def convert(infile, outfile):
+    """Convert a text `.ls8` file into an image."""
+
+    with open(infile) as f:
+        program = parse_ls8(f)
+
+    write_image(outfile, program)
+
+    return len(program)
+
+
+def main(argv):
+    if len(argv) == 2:
+        infile = argv[1]
+        outfile = infile.rsplit(".", 1)[0] + ".ls8b"
+
+    elif len(argv) == 3:
+        infile, outfile = argv[1], argv[2]
+
+    else:
+        print("usage: image.py infile.ls8 [outfile.ls8b]", file=sys.stderr)
+        return 1
+
+    size = convert(infile, outfile)
+    print(f"{infile} -> {outfile} ({size} bytes)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,118 @@
+"""Cache of parsed programs, so repeat loads skip the parsing."""
+
+# Batch jobs load the same handful of programs over and over. The first load
+# of a file parses it (text .ls8) or unpacks it (binary image); after that
+# the program bytes come out of an in-memory LRU cache keyed by the file's
+# path, mtime and size, so loading is just a copy into RAM.
+#
+# With a cache directory, parsed programs are also written out as images
+# named after a hash of the source file's contents. A new process (or a
+# copy of the same file somewhere else) then skips the parse too.
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import image
+
+
+class ProgramCache:
+    """LRU cache of program bytes, optionally backed by a directory."""
+
+    def __init__(self, maxsize=64, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.programs = OrderedDict()  # key -> (program, entry)
+
+        # counters, so you can check the cache is actually being used
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, filename):
+        """Return (program bytes, entry point) for `filename`."""
+
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+        cached = self.programs.get(key)
+
+        if cached is not None:
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return cached
+
+        self.misses += 1
+
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        cached = self.load_from_disk(data)
+
+        if cached is None:
+            cached = self.parse(data)
+            self.save_to_disk(data, cached)
+
+        self.programs[key] = cached
+
+        if len(self.programs) > self.maxsize:
+            self.programs.popitem(last=False)  # least recently used
+
+        return cached
+
+    def parse(self, data):
+        """Parse file contents, either format, into (program, entry)."""
+
+        if data.startswith(image.MAGIC):
+            return image.unpack_image(data)
+
+        return bytes(image.parse_ls8(data.decode().splitlines())), 0
+
+    def disk_path(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".ls8b")
+
+    def load_from_disk(self, data):
+        if self.cache_dir is None:
+            return None
+
+        try:
+            with open(self.disk_path(data), "rb") as f:
+                cached = image.unpack_image(f.read())
+        except (OSError, ValueError):
+            return None
+
+        self.disk_hits += 1
+        return cached
+
+    def save_to_disk(self, data, cached):
+        if self.cache_dir is None:
+            return
+
+        program, entry = cached
+        path = self.disk_path(data)
+
+        # write then rename, so a reader never sees half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        image.write_image(tmp, program, entry)
+        os.replace(tmp, path)
+
+    def clear(self):
+        """Empty the in-memory cache (the directory is left alone)."""
+        self.programs.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "size": len(self.programs),
+        }
+
+
+# Shared by every CPU unless told otherwise. Set LS8_CACHE_DIR to persist
+# parsed programs between runs.
+cache = ProgramCache(cache_dir=os.environ.get("LS8_CACHE_DIR"))
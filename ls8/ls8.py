@@ -4,9 +4,46 @@
 
 import sys
 from cpu import *
+from devices import run_stdio
+from events import Timer
 
 cpu = CPU()
 
 # cpu.load()
+
+# text .ls8 files and binary images (see image.py) both work here
 cpu.load_ram()
-cpu.run()
+
+# --checkpoint file.ckpt saves the machine's state every million cycles, and
+# if the file is already there, carries on from the last state saved in it
+# (see checkpoint.py)
+checkpointer = None
+
+if "--checkpoint" in sys.argv[2:-1]:
+    from checkpoint import Checkpointer, resume
+    filename = sys.argv[sys.argv.index("--checkpoint") + 1]
+    resume(cpu, filename)
+    checkpointer = Checkpointer(cpu, filename)
+
+# python3 ls8.py program.ls8 --record file.replay logs the timer ticks and
+# key presses, so the run can be repeated exactly (see replay.py)
+recorder = None
+
+if "--record" in sys.argv[2:-1]:
+    from replay import Recorder
+    recorder = Recorder(cpu, every=1000000)
+
+# the timer interrupt (I0) ticks once a second
+Timer().start(cpu)
+
+# cpu.run()
+
+# run in slices with stdin as the keyboard (I1), see devices.py
+try:
+    run_stdio(cpu)
+finally:
+    if checkpointer is not None:
+        checkpointer.close()
+
+    if recorder is not None:
+        recorder.stop().save(sys.argv[sys.argv.index("--record") + 1])
@@ -0,0 +1,90 @@
+"""Instruction-mix profile for CPU(profile=True)."""
+
+# The profiled run loop (CPU.run_profiled) fills one of these in as it goes:
+#
+# * instructions retired
+# * how often each opcode ran, and each address
+# * CALL/RET counts per subroutine (keyed by the address CALL jumped to)
+# * host time spent per opcode class
+#
+# report() turns it into plain dicts and lists, ready for json.
+
+import json
+
+import cpu as _cpu
+
+# Opcode -> mnemonic, from the names of the CPU's handlers
+MNEMONICS = {
+    opcode: handler.__name__[len("handle_"):].upper()
+    for opcode, handler in enumerate(_cpu.CPU.branchtable)
+    if handler is not _cpu.CPU.handle_unknown
+}
+
+# Opcode -> class, for the host-time breakdown
+CLASSES = ["unknown"] * 256
+
+for opcode in MNEMONICS:
+    if opcode in (_cpu.PRN, _cpu.PRA):
+        CLASSES[opcode] = "io"
+    elif opcode in (_cpu.PUSH, _cpu.POP):
+        CLASSES[opcode] = "stack"
+    elif opcode in (_cpu.LDI, _cpu.LD, _cpu.ST):
+        CLASSES[opcode] = "memory"
+    elif opcode & 0b00100000:  # `B`: handled by the ALU
+        CLASSES[opcode] = "alu"
+    elif opcode & 0b00010000:  # `C`: sets the PC
+        CLASSES[opcode] = "branch"
+    else:
+        CLASSES[opcode] = "control"  # HLT, NOP
+
+
+class Profile:
+    """Counters collected by a profiled run."""
+
+    def __init__(self):
+        self.instructions = 0
+        self.opcodes = [0] * 256
+        self.addresses = [0] * 256
+        self.class_time = dict.fromkeys(set(CLASSES), 0)  # nanoseconds
+
+        # subroutine address -> [calls, returns]
+        self.subroutines = {}
+        # subroutines we're inside of, so RET knows whose return it is
+        self.call_stack = []
+
+    def call(self, target):
+        self.subroutines.setdefault(target, [0, 0])[0] += 1
+        self.call_stack.append(target)
+
+    def ret(self):
+        if self.call_stack:
+            self.subroutines[self.call_stack.pop()][1] += 1
+
+    def report(self):
+        """The profile as plain data."""
+
+        return {
+            "instructions": self.instructions,
+            "opcodes": {
+                MNEMONICS.get(op, f"{op:08b}"): count
+                for op, count in enumerate(self.opcodes) if count
+            },
+            "addresses": {
+                f"{address:02X}": count
+                for address, count in enumerate(self.addresses) if count
+            },
+            "subroutines": {
+                f"{address:02X}": {"calls": calls, "returns": returns}
+                for address, (calls, returns)
+                in sorted(self.subroutines.items())
+            },
+            "class_time_ns": {
+                name: ns for name, ns in self.class_time.items() if ns
+            },
+        }
+
+    def dump(self, filename):
+        """Write report() to `filename` as JSON."""
+
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""Record and replay the outside world, so any run can be repeated exactly."""
+
+# Left to itself the CPU is deterministic. What isn't is everything that
+# comes from outside: when the wall-clock timer goes off, which key is
+# pressed and when. A Recorder logs each of those as it happens, as
+#
+#   (cycle, kind, value)
+#
+# where kind is KEY (value written to 0xF4) or INTERRUPT (value is the
+# interrupt number). A key press is both: CPU.key() logs the byte and then
+# the interrupt it raises.
+#
+# Replay puts the CPU back in the state recording started from and schedules
+# every logged event (see events.py) for the cycle it came in on, so the
+# program sees exactly what it saw the first time. Don't start a Timer or
+# attach devices to a replaying CPU; their interrupts are in the log already.
+# It also has to run the same way (engine, fusion) as the recording, so it
+# stops between instructions at the same cycle counts.
+#
+# With `every`, the Recorder also takes a snapshot (see snapshot.py) every
+# so many cycles. Replay.seek() restores the last one before the cycle it's
+# asked for and only runs forward from there, instead of from the start.
+#
+# File layout (little-endian):
+#
+#   offset  size  field
+#   0       4     magic, b"LS8R"
+#   4       1     format version
+#   5       4     number of events
+#   9       4     number of keyframes
+#   13      280   snapshot at the start
+#   ...           events, 10 bytes each: cycle (8), kind (1), value (1)
+#   ...           keyframes, 284 bytes each: events logged before it (4),
+#                 then the snapshot
+#
+# Usage: replay.py file.replay [cycle]
+
+import struct
+import sys
+
+import snapshot
+from cpu import KEY as KEY_ADDRESS
+
+MAGIC = b"LS8R"
+VERSION = 1
+HEADER = struct.Struct("<4sBII")
+EVENT = struct.Struct("<QBB")
+KEYFRAME = struct.Struct("<I")
+
+# event kinds
+KEY = 0
+INTERRUPT = 1
+
+
+class Recording:
+    """A start state, the events that followed it, and keyframes."""
+
+    def __init__(self, start, events=None, keyframes=None):
+        self.start = start  # snapshot bytes
+        self.events = events if events is not None else []
+        # (events logged before it, snapshot bytes), oldest first
+        self.keyframes = keyframes if keyframes is not None else []
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.events),
+                                len(self.keyframes)))
+            f.write(self.start)
+
+            for event in self.events:
+                f.write(EVENT.pack(*event))
+
+            for count, state in self.keyframes:
+                f.write(KEYFRAME.pack(count))
+                f.write(state)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        magic, version, events, keyframes = HEADER.unpack_from(data)
+
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not an LS-8 recording")
+        if version != VERSION:
+            raise ValueError(
+                f"{filename}: unsupported recording version {version}")
+
+        size = (HEADER.size + snapshot.SIZE + events * EVENT.size +
+                keyframes * (KEYFRAME.size + snapshot.SIZE))
+
+        if len(data) < size:
+            raise ValueError(f"{filename} is truncated")
+
+        offset = HEADER.size
+        start = data[offset:offset + snapshot.SIZE]
+        offset += snapshot.SIZE
+
+        recording = cls(start)
+
+        for i in range(events):
+            recording.events.append(EVENT.unpack_from(data, offset))
+            offset += EVENT.size
+
+        for i in range(keyframes):
+            count, = KEYFRAME.unpack_from(data, offset)
+            offset += KEYFRAME.size
+            state = data[offset:offset + snapshot.SIZE]
+            offset += snapshot.SIZE
+            recording.keyframes.append((count, state))
+
+        return recording
+
+
+class Recorder:
+    """Logs the external events that reach `cpu` until stop()."""
+
+    def __init__(self, cpu, every=None):
+        """`every`: take a keyframe snapshot every this many cycles."""
+
+        self.cpu = cpu
+        self.every = every
+        self.recording = Recording(cpu.snapshot())
+        self.stopped = False
+
+        cpu.recorder = self
+
+        if every is not None:
+            cpu.schedule(cpu.cycles + every, self.keyframe)
+
+    def key(self, value):
+        """Called by CPU.key()."""
+        self.recording.events.append((self.cpu.cycles, KEY, value))
+
+    def interrupt(self, number):
+        """Called by CPU.interrupt()."""
+        self.recording.events.append((self.cpu.cycles, INTERRUPT, number))
+
+    def keyframe(self, cpu, cycle):
+        if self.stopped:
+            return
+
+        events = len(self.recording.events)
+        self.recording.keyframes.append((events, cpu.snapshot()))
+        cpu.schedule(cycle + self.every, self.keyframe)
+
+    def stop(self):
+        """Stop recording and return the Recording."""
+
+        self.stopped = True
+
+        if self.cpu.recorder is self:
+            self.cpu.recorder = None
+
+        return self.recording
+
+
+class Replay:
+    """Plays a Recording back on `cpu`."""
+
+    def __init__(self, cpu, recording):
+        self.cpu = cpu
+        self.recording = recording
+        self.rewind(recording.start, 0)
+
+    def rewind(self, state, first):
+        """Restore `state` and queue the events from number `first` on."""
+
+        cpu = self.cpu
+        cpu.restore(state)
+        cpu.events.clear()
+
+        for cycle, kind, value in self.recording.events[first:]:
+            if kind == KEY:
+                cpu.schedule(cycle, _key(value))
+            else:
+                cpu.schedule(cycle, _interrupt(value))
+
+    def run(self, max_cycles=None):
+        """Carry on replaying, for `max_cycles` or until HLT."""
+        self.cpu.run(max_cycles)
+
+    def seek(self, cycle):
+        """
+        Put the CPU in the state it was in at `cycle`.
+
+        Starts from the last keyframe at or before `cycle`, or carries on
+        from where it is if that's closer. (With the blocks engine it can
+        end up a few instructions past `cycle`; see CPU.run.)
+        """
+
+        cpu = self.cpu
+        state, first = self.recording.start, 0
+
+        for count, keyframe in self.recording.keyframes:
+            if snapshot.unpack(keyframe)[4] > cycle:
+                break
+
+            state, first = keyframe, count
+
+        if not snapshot.unpack(state)[4] <= cpu.cycles <= cycle:
+            self.rewind(state, first)
+
+        if cpu.cycles < cycle and not cpu.halted:
+            cpu.run(cycle - cpu.cycles)
+
+
+def _key(value):
+    def event(cpu, cycle):
+        # just the byte: the interrupt it raised has its own entry
+        cpu.ram_write(value, KEY_ADDRESS)
+
+    return event
+
+
+def _interrupt(number):
+    def event(cpu, cycle):
+        cpu.interrupt(number)
+
+    return event
+
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        print("usage: replay.py file.replay [cycle]", file=sys.stderr)
+        return 1
+
+    recording = Recording.load(argv[1])
+    start = snapshot.unpack(recording.start)[4]
+
+    print(f"{len(recording.events)} events, "
+          f"{len(recording.keyframes)} keyframes, from cycle {start}")
+
+    if len(argv) == 3:
+        from cpu import CPU
+
+        replay = Replay(CPU(), recording)
+        replay.seek(int(argv[2]))
+
+        for line in snapshot.render(replay.cpu.snapshot()):
+            print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
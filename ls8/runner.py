@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""Run a batch of LS-8 programs across a pool of processes."""
+
+# A manifest is a JSON list of jobs. Each job names a program and can give
+# it an initial state:
+#
+#   [
+#       {"program": "examples/sctest.ls8"},
+#       {"program": "examples/call.ls8", "engine": "blocks"},
+#       {"program": "examples/mult.ls8",
+#        "reg": [0, 0, 0, 0, 0, 0, 0, 244],
+#        "memory": {"0x80": [1, 2, 3]},
+#        "pc": 0},
+#       {"program": "examples/interrupts.ls8", "max_cycles": 100000}
+#   ]
+#
+# `memory` maps a start address to bytes poked into RAM after loading.
+# `max_cycles` caps how long a job runs (MAX_CYCLES if not given), so one
+# that never halts can't hold up its worker and the batch with it; its
+# result says "halted": false.
+# Relative program paths are relative to the manifest file.
+#
+# Jobs are handed to the pool in chunks, so each round trip to a worker
+# carries many jobs and the IPC cost is shared between them. Each worker
+# process also keeps its own loader cache, so programs that show up in many
+# jobs get parsed once per worker.
+#
+# Usage: runner.py manifest.json [workers]
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU
+from sinks import CaptureSink
+
+# Default cycle limit for a job
+MAX_CYCLES = 10000000
+
+
+def run_job(job):
+    """Run one job in this process and return its result dict."""
+
+    result = {"program": job["program"]}
+    start = time.perf_counter()
+    output = CaptureSink()
+
+    cpu = CPU(engine=job.get("engine", "interpreter"), sink=output)
+
+    try:
+        cpu.load_file(job["program"])
+
+        for i, value in enumerate(job.get("reg", [])):
+            cpu.reg[i] = value
+
+        for address, values in job.get("memory", {}).items():
+            address = int(address, 0)
+
+            if not 0 <= address <= address + len(values) <= len(cpu.ram):
+                raise ValueError(f"memory at {address:#x}: {len(values)} "
+                                 f"bytes won't fit in RAM")
+
+            cpu.ram[address:address + len(values)] = bytes(values)
+
+        cpu.pc = job.get("pc", cpu.pc)
+        cpu.flush()
+
+        cpu.run(job.get("max_cycles", MAX_CYCLES))
+
+    except (Exception, SystemExit) as e:
+        # a bad program shouldn't take the rest of the batch down with it
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["output"] = output.getvalue()
+    result["reg"] = list(cpu.reg)
+    result["pc"] = cpu.pc
+    result["fl"] = cpu.fl
+    result["cycles"] = cpu.cycles
+    result["halted"] = cpu.halted
+    result["wall_time"] = time.perf_counter() - start
+
+    return result
+
+
+def run_jobs(jobs, workers=None, chunksize=None):
+    """
+    Run `jobs` across `workers` processes (default: one per CPU).
+
+    Results come back in the same order as the jobs.
+    """
+
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+
+    if chunksize is None:
+        # a few chunks per worker balances load without many round trips
+        chunksize = max(1, len(jobs) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_job, jobs, chunksize=chunksize))
+
+
+def load_manifest(filename):
+    """Read a manifest, resolving program paths against its directory."""
+
+    with open(filename) as f:
+        jobs = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(filename))
+
+    for job in jobs:
+        job["program"] = os.path.join(base, job["program"])
+
+    return jobs
+
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        print("usage: runner.py manifest.json [workers]", file=sys.stderr)
+        return 1
+
+    jobs = load_manifest(argv[1])
+    workers = int(argv[2]) if len(argv) == 3 else None
+
+    results = run_jobs(jobs, workers)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    failed = any("error" in r or not r["halted"] for r in results)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
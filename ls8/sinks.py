@@ -0,0 +1,70 @@
+"""Output sinks for PRN and PRA."""
+
+# Calling print() for every PRN means a write (and, on a terminal, a flush)
+# per instruction. A sink collects the text instead and decides when it
+# actually goes anywhere. Every sink has the same two methods:
+#
+#   write(text)  take some output
+#   flush()      push out anything buffered; the CPU calls this on HLT
+
+
+import io
+import sys
+
+
+class StdoutSink:
+    """Buffers output and writes it to stdout in large chunks."""
+
+    def __init__(self, threshold=8192, stream=None):
+        self.threshold = threshold
+        self.stream = stream
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+
+        if self.size >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        # look stdout up late, so redirect_stdout() and friends still work
+        stream = self.stream or sys.stdout
+        stream.write("".join(self.buffer))
+        stream.flush()
+
+        self.buffer = []
+        self.size = 0
+
+
+# Where a CPU's output goes if it isn't given a sink. Sharing one keeps each
+# CPU small, and output from several still comes out in the order written.
+STDOUT = StdoutSink()
+
+
+class CaptureSink:
+    """Keeps all output in memory, e.g. for batch runs."""
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.write = self.buffer.write
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+class NullSink:
+    """Throws output away, for benchmarks."""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
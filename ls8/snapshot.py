@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Machine state snapshots, for CPU.snapshot() and CPU.restore()."""
+
+# A snapshot is everything a program can see of the machine: RAM, the
+# registers, PC, FL, and which interrupts are pending or enabled. Take one
+# after a long setup and every later run can start from there with a single
+# restore() instead of going through the setup again.
+#
+# It's a fixed SIZE bytes, so restore() can read it straight out of any
+# buffer: bytes, a memoryview, or a file mapped with open_snapshot(). Mapping
+# a snapshot once and restoring from it over and over costs one copy into
+# RAM per restore and no file reads at all.
+#
+# Layout (little-endian):
+#
+#   offset  size  field
+#   0       4     magic, b"LS8S"
+#   4       1     format version
+#   5       1     PC
+#   6       1     FL
+#   7       1     flags: bit 0 interrupts enabled, bit 1 halted
+#   8       8     R0-R7 (IM and IS hold the masked and pending interrupts)
+#   16      8     instructions executed so far
+#   24      256   RAM
+#
+# Scheduled events (timers and the like) belong to the host, not the
+# machine, so they aren't saved; they stay as they are on the CPU a
+# snapshot is restored into.
+#
+# Usage: snapshot.py file.snap
+
+import mmap
+import struct
+import sys
+
+MAGIC = b"LS8S"
+VERSION = 1
+STATE = struct.Struct("<4sBBBB8sQ256s")
+SIZE = STATE.size
+
+# flags byte
+IE = 0b01
+HALTED = 0b10
+
+
+def pack(cpu):
+    """The state of `cpu` as snapshot bytes."""
+
+    flags = (IE if cpu.ie else 0) | (HALTED if cpu.halted else 0)
+
+    return STATE.pack(MAGIC, VERSION, cpu.pc, cpu.fl, flags, bytes(cpu.reg),
+                      cpu.cycles, bytes(cpu.ram))
+
+
+def unpack(data):
+    """
+    Split snapshot bytes (any buffer) into (pc, fl, flags, reg, cycles, ram).
+
+    Raises ValueError if `data` isn't a snapshot this version can read.
+    """
+
+    if len(data) < SIZE:
+        raise ValueError("snapshot is truncated")
+
+    magic, version, pc, fl, flags, reg, cycles, ram = STATE.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError("not an LS-8 snapshot")
+    if version != VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+
+    return pc, fl, flags, reg, cycles, ram
+
+
+def write_snapshot(filename, cpu):
+    """Save the state of `cpu` to `filename`."""
+
+    with open(filename, "wb") as f:
+        f.write(pack(cpu))
+
+
+def open_snapshot(filename):
+    """
+    Map the snapshot in `filename` read-only, checking it on the way.
+
+    The result can be passed to CPU.restore() as many times as you like.
+    Close it when done.
+    """
+
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        unpack(data)
+    except ValueError as e:
+        data.close()
+        raise ValueError(f"{filename}: {e}") from None
+
+    return data
+
+
+def render(data):
+    """A snapshot as lines of text: the registers, then a RAM dump."""
+
+    pc, fl, flags, reg, cycles, ram = unpack(data)
+
+    lines = [
+        f"PC {pc:02X}  FL {fl:03b}  IE {'on' if flags & IE else 'off'}"
+        f"{'  halted' if flags & HALTED else ''}  {cycles} cycles",
+        " ".join(f"R{i} {value:02X}" for i, value in enumerate(reg)),
+    ]
+
+    for address in range(0, 256, 16):
+        row = " ".join(f"{value:02X}" for value in ram[address:address + 16])
+        lines.append(f"{address:02X}: {row}")
+
+    return lines
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: snapshot.py file.snap", file=sys.stderr)
+        return 1
+
+    with open(argv[1], "rb") as f:
+        for line in render(f.read()):
+            print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Binary instruction trace for CPU(trace=...)."""
+
+# CPU.trace() prints a line per instruction, which is far too slow to leave
+# on. The traced run loop (CPU.run_traced) instead copies each instruction's
+# state into a preallocated ring buffer, so only the last `depth` records
+# are kept and nothing is formatted until someone asks for it.
+#
+# A record is RECORD bytes, taken just before the instruction runs:
+#
+#   offset  size  field
+#   0       1     PC
+#   1       3     the byte at PC and the two after it (opcode, operands)
+#   4       8     R0-R7
+#   12      1     FL
+#
+# dump() writes the buffer out oldest record first, behind a small header:
+#
+#   offset  size  field
+#   0       4     magic, b"LS8T"
+#   4       1     format version
+#   5       4     number of records that follow
+#   9       8     instructions executed before the first of them
+#
+# Usage: tracer.py file.trace
+
+import struct
+import sys
+
+MAGIC = b"LS8T"
+VERSION = 1
+HEADER = struct.Struct("<4sBIQ")
+
+RECORD = 13
+
+
+class Trace:
+    """Ring buffer of the last `depth` instructions executed."""
+
+    def __init__(self, depth=1024, filename=None):
+        """
+        `filename`, if given, is where the CPU dumps the buffer when a run
+        stops (HLT, a fault or an exception).
+        """
+        self.depth = depth
+        self.filename = filename
+        self.buffer = bytearray(depth * RECORD)
+        self.position = 0  # offset of the next record to write
+        self.count = 0  # records written in total, including overwritten
+
+    def records(self):
+        """The buffered records, oldest first, as bytes."""
+
+        if self.count < self.depth:
+            return bytes(self.buffer[:self.position])
+
+        # full: the oldest record is the one about to be overwritten
+        return bytes(self.buffer[self.position:] +
+                     self.buffer[:self.position])
+
+    def dump(self, filename=None):
+        """Write the buffer to `filename` (default: self.filename)."""
+
+        records = self.records()
+        kept = len(records) // RECORD
+
+        with open(filename or self.filename, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, kept, self.count - kept))
+            f.write(records)
+
+
+def read_trace(filename):
+    """
+    Read a dumped trace.
+
+    Returns (first, records): the instruction number of the first record and
+    a list of (pc, opcode, operand_a, operand_b, regs, fl) tuples.
+    """
+
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    magic, version, count, first = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError(f"{filename} is not an LS-8 trace")
+    if version != VERSION:
+        raise ValueError(f"{filename}: unsupported trace version {version}")
+    if len(data) < HEADER.size + count * RECORD:
+        raise ValueError(f"{filename} is truncated")
+
+    records = []
+
+    for i in range(count):
+        offset = HEADER.size + i * RECORD
+        r = data[offset:offset + RECORD]
+        records.append((r[0], r[1], r[2], r[3], tuple(r[4:12]), r[12]))
+
+    return first, records
+
+
+def render(record):
+    """Format one record the way CPU.trace() prints it."""
+
+    pc, opcode, operand_a, operand_b, regs, fl = record
+
+    line = "TRACE: %02X | %02X %02X %02X |" % (pc, opcode, operand_a,
+                                               operand_b)
+
+    for value in regs:
+        line += " %02X" % value
+
+    return line
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: tracer.py file.trace", file=sys.stderr)
+        return 1
+
+    first, records = read_trace(argv[1])
+
+    if first:
+        print(f"({first} earlier instructions not kept)", file=sys.stderr)
+
+    for record in records:
+        print(render(record))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))